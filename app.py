@@ -1,27 +1,45 @@
-import time
-import io
 import streamlit as st
-from PIL import Image
+from dataclasses import asdict, replace
 
 # 👇 [변경된 부분] 파일 이름 변경에 따른 import 수정
 from phodong_upload import (
-    StoryConfig, StoryCard, LLMService, AudioService, Utils,
+    StoryConfig, StoryCard, FinalStory, LLMService, PreparedImage, AssetStore,
     GENRE_OPTIONS, PURPOSE_OPTIONS
 )
 from phodong_live import CameraManager
+from phodong_metrics import METRICS
+from phodong_backends import SCHEDULER, init_runtime
+from phodong_jobs import JOBS, run_cards_job, run_final_job, run_export_job
+from phodong_export import Storybook, EXPORT_FORMATS
 
 # ==============================================================================
 # CONFIG & CSS
 # ==============================================================================
 st.set_page_config(page_title="포동 PHODONG", page_icon="🧸", layout="wide")
+JOB_POLL_SEC = 1.0  # 생성 작업 진행 상황을 다시 그리는 간격
 
 def get_api_key():
     import os
+    init_runtime()  # .env는 키가 처음 필요할 때 읽음
     key = os.getenv("GOOGLE_API_KEY")
-    if not key and "GOOGLE_API_KEY" in st.secrets:
-        key = st.secrets["GOOGLE_API_KEY"]
+    if not key:
+        # secrets.toml이 없으면 st.secrets 접근 자체가 예외를 내므로 환경 변수/.env만 사용
+        try: key = st.secrets.get("GOOGLE_API_KEY")
+        except Exception: key = None
     return key
 
+def get_session_id():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        if ctx: return ctx.session_id
+    except Exception: pass
+    return "local"
+
+def get_llm():
+    """세션 id가 붙은 LLMService (백엔드 클라이언트와 스케줄러는 프로세스 전체에서 공유)"""
+    return LLMService(get_api_key(), session_id=get_session_id())
+
 def inject_css():
     st.markdown("""
     <style>
@@ -52,10 +70,67 @@ class AppState:
         if "show_final" not in st.session_state: st.session_state.show_final = False
         if "story_config" not in st.session_state: st.session_state.story_config = StoryConfig()
         if "story_cards" not in st.session_state: st.session_state.story_cards = []
-        if "final_story_text" not in st.session_state: st.session_state.final_story_text = None
+        if "final_story" not in st.session_state: st.session_state.final_story = None
         if "final_audio_data" not in st.session_state: st.session_state.final_audio_data = None
         if "generation_complete" not in st.session_state: st.session_state.generation_complete = False
-        if "image_storage" not in st.session_state: st.session_state.image_storage = {}
+        if "image_storage" not in st.session_state: st.session_state.image_storage = AssetStore()
+        if "fresh_story" not in st.session_state: st.session_state.fresh_story = False
+        if "last_trace" not in st.session_state: st.session_state.last_trace = None
+        if "cards_job" not in st.session_state: st.session_state.cards_job = None
+        if "final_job" not in st.session_state: st.session_state.final_job = None
+        if "export_job" not in st.session_state: st.session_state.export_job = None
+        if "last_summary" not in st.session_state: st.session_state.last_summary = {}
+
+    @staticmethod
+    def reattach():
+        """새로고침 등으로 세션이 새로 만들어졌을 때 주소의 작업 id로 진행 중/완료된 작업에 다시 붙음"""
+        params = st.query_params
+        if not st.session_state.cards_job and not st.session_state.generation_complete and params.get("job"):
+            st.session_state.cards_job = params.get("job")
+            st.session_state.mode = st.session_state.mode or "upload"
+        if not st.session_state.final_job and not st.session_state.final_story and params.get("final"):
+            st.session_state.final_job = params.get("final")
+            st.session_state.show_final = True
+
+    @staticmethod
+    def detach_jobs():
+        st.session_state.cards_job = st.session_state.final_job = None
+        st.query_params.clear()
+
+    @staticmethod
+    def apply_cards_job(job):
+        """끝난 카드 작업의 결과를 세션 상태로 옮김"""
+        if job.status != "done":
+            st.toast(f"이야기를 만들지 못했어요: {job.error}")
+            AppState.detach_jobs()
+            return
+        # 이전 앨범의 이미지는 버리고 이번 이야기의 이미지로 교체 (한도를 넘으면 줄여서 저장)
+        dropped = st.session_state.image_storage.replace(job.result["images"])
+        if dropped: st.toast(f"사진 {len(dropped)}장은 저장 한도 때문에 사진 없이 보여줘요")
+        st.session_state.story_cards = list(job.result["cards"])
+        st.session_state.story_config = job.meta.get("config", st.session_state.story_config)
+        st.session_state.last_trace = job.trace
+        st.session_state.last_summary = job.result.get("summary", {})
+        st.session_state.generation_complete = True
+        if st.session_state.last_summary.get("near_duplicates"):
+            st.toast(f"🧩 비슷한 사진 {st.session_state.last_summary['near_duplicates']}장은 이야기를 함께 썼어요")
+
+    @staticmethod
+    def apply_final_job(job):
+        result = job.result or {"story": FinalStory.failed(), "audio": None}
+        st.session_state.final_story = result["story"]
+        st.session_state.final_audio_data = result["audio"]
+        st.session_state.last_trace = job.trace
+
+    @staticmethod
+    def report_memory():
+        """세션이 붙잡고 있는 이미지 메모리를 계측 모듈에 보고"""
+        captures = st.session_state.get("camera_captures", [])
+        METRICS.set_session_memory(
+            get_session_id(),
+            image_storage=st.session_state.image_storage.nbytes,
+            camera_captures=sum(len(p.display_jpeg) + p.thumbnail.width * p.thumbnail.height * 3 for p in captures),
+        )
 
 # ==============================================================================
 # UI PAGES
@@ -85,49 +160,59 @@ def render_config():
         st.session_state.story_config.age = c1.text_input("나이", st.session_state.story_config.age)
         st.session_state.story_config.genre = c2.selectbox("장르", GENRE_OPTIONS)
         st.session_state.story_config.purpose = c1.selectbox("목적", PURPOSE_OPTIONS)
+        st.session_state.fresh_story = c2.checkbox("🔄 새로운 이야기로 만들기", st.session_state.fresh_story, help="같은 사진이어도 저장된 이야기 대신 새로 지어요.")
+
+def speculate_card(img):
+    """촬영 직후 카드 생성을 백그라운드에서 미리 시작 (설정이 바뀌면 만들기 시점에 다시 생성)"""
+    config = replace(st.session_state.story_config)
+    try: llm = get_llm()
+    except Exception: return None
+    return asdict(config), llm.submit_story_card(img, config, use_cache=not st.session_state.fresh_story)
 
-def process_images(files):
+def process_images(files, prefetched=None):
+    """카드 생성을 작업자에 맡기고 바로 돌아옴 (진행 상황은 cards_job_view가 폴링)"""
     try:
-        api_key = get_api_key()
-        llm = LLMService(api_key)
+        llm = get_llm()
     except Exception as e:
         st.error(f"API 키 오류: {e}")
         return
 
-    ph = st.empty()
-    with ph.container():
-        st.markdown("<div class='loader-overlay'><h2>🔮 포동이가 이야기를 짓고 있어요...</h2></div>", unsafe_allow_html=True)
-        cards = []
-        prog = st.progress(0)
-        
-        for i, f in enumerate(files):
-            f.seek(0)
-            f_bytes = f.read()
-            pil_img = Image.open(io.BytesIO(f_bytes))
-            card = llm.generate_story_card(io.BytesIO(f_bytes), st.session_state.story_config)
-            if card:
-                card.image_key = f"img_{i}_{int(time.time())}"
-                st.session_state.image_storage[card.image_key] = pil_img
-                cards.append(card)
-            prog.progress((i+1)/len(files))
-        
-        st.session_state.story_cards = cards
-        st.session_state.generation_complete = True
-    ph.empty()
+    sources = [f if isinstance(f, PreparedImage) else f.getvalue() for f in files]
+    config = replace(st.session_state.story_config)
+    use_cache = not st.session_state.fresh_story
+    job = JOBS.submit("cards", lambda job: run_cards_job(job, llm, sources, config, use_cache, prefetched),
+                      total=len(sources), config=config)
+    st.session_state.cards_job = job.job_id
+    st.query_params["job"] = job.job_id  # 새로고침해도 이 id로 다시 붙음
     st.rerun()
 
+@st.fragment(run_every=JOB_POLL_SEC)
+def cards_job_view():
+    job = JOBS.get(st.session_state.cards_job)
+    if job is None:
+        st.toast("작업을 찾을 수 없어요. 다시 만들어 주세요.")
+        AppState.detach_jobs()
+        st.rerun()
+
+    st.markdown(f"<div class='loader-overlay'><h2>🔮 포동이가 이야기를 짓고 있어요...</h2><p>{job.done} / {job.total}</p></div>", unsafe_allow_html=True)
+    st.progress(job.progress)
+    if job.finished:
+        AppState.apply_cards_job(job)
+        st.rerun()
+
 def scene_view():
     idx = st.session_state.page_idx
     cards = st.session_state.story_cards
     if not cards: return st.error("생성된 이야기가 없습니다.")
     
     card = cards[idx]
-    b64 = Utils.get_image_base64(st.session_state.image_storage.get(card.image_key))
+    b64 = st.session_state.image_storage.get_b64(card.image_key)
     
     st.markdown(f"### Scene {idx+1}")
     c1, c2 = st.columns(2)
     with c1:
-        st.markdown(f"<div class='polaroid-frame'><img src='data:image/jpeg;base64,{b64}' class='polaroid-img'><div class='polaroid-label'>{card.character_name}</div></div>", unsafe_allow_html=True)
+        img = f"<img src='data:image/jpeg;base64,{b64}' class='polaroid-img'>" if b64 else "<div class='polaroid-img' style='font-size:4rem; text-align:center;'>🖼️</div>"
+        st.markdown(f"<div class='polaroid-frame'>{img}<div class='polaroid-label'>{card.character_name}</div></div>", unsafe_allow_html=True)
     with c2:
         st.markdown(f"<div class='dialogue-box'>\"{card.dialogue}\"</div>", unsafe_allow_html=True)
         st.info(f"상황: {card.story_narration}")
@@ -139,47 +224,9 @@ def scene_view():
     else:
         if c_next.button("✨ 완성하기", type="primary"): st.session_state.show_final = True; st.rerun()
 
-def final_view():
-    # 1. 아직 이야기가 없으면 생성 (기존 로직 유지)
-    if not st.session_state.final_story_text:
-        with st.spinner("책 엮는 중..."):
-            llm = LLMService(get_api_key())
-            text = llm.generate_final_story(st.session_state.story_cards, st.session_state.story_config)
-            audio = AudioService.create(text)
-            st.session_state.final_story_text = text
-            st.session_state.final_audio_data = audio
-            st.rerun()
-            
-    # 2. [수정됨] JSON 파싱 및 이쁜 디자인 적용
-    import json # JSON 처리를 위해 임포트
-    
-    raw_text = st.session_state.final_story_text
-    title = "나만의 동화책"
-    body = raw_text
-
-    # JSON 파싱 시도 (제목과 본문 분리)
-    try:
-        data = json.loads(raw_text)
-        if isinstance(data, list) and len(data) > 0: data = data[0]
-        if isinstance(data, dict):
-            title = data.get("title", "제목 없는 동화")
-            body = data.get("story", raw_text)
-    except:
-        # JSON이 아닐 경우 첫 줄을 제목으로 사용
-        lines = raw_text.strip().split('\n')
-        if len(lines) > 1:
-            title = lines[0].replace("#", "").strip()
-            body = "\n".join(lines[1:])
-
-    # 3. 화면 렌더링
-    st.markdown("<div style='height: 20px;'></div>", unsafe_allow_html=True)
-    st.markdown("<h2 style='text-align:center; color:#FF9EAA; font-size:2.5rem; margin-bottom:30px;'>🎉 동화책이 완성되었어요!</h2>", unsafe_allow_html=True)
-    
-    c1, c2 = st.columns([1.5, 1], gap="large")
-    
-    # [왼쪽] 책 모양 디자인 (인라인 스타일 사용으로 CSS 수정 없이 적용)
-    with c1:
-        st.markdown(f"""
+def render_book(title, body):
+    """책 모양 패널 HTML (인라인 스타일 사용으로 CSS 수정 없이 적용)"""
+    return f"""
         <div style="background-color: white; padding: 40px; border-radius: 15px; box-shadow: 0 10px 40px rgba(0,0,0,0.08); border-left: 10px solid #FF9EAA;">
             <div style="font-family: 'Jua', sans-serif; font-size: 2.0rem; color: #FF9EAA; text-align: center; margin-bottom: 20px;">
                 {title}
@@ -189,7 +236,88 @@ def final_view():
                 {body}
             </div>
         </div>
-        """, unsafe_allow_html=True)
+        """
+
+def start_final_job():
+    llm = get_llm()
+    cards, config = list(st.session_state.story_cards), replace(st.session_state.story_config)
+    job = JOBS.submit("final", lambda job: run_final_job(job, llm, cards, config))
+    st.session_state.final_job = job.job_id
+    st.query_params["final"] = job.job_id
+
+@st.fragment(run_every=JOB_POLL_SEC)
+def final_job_view():
+    """작업이 쌓는 텍스트를 폴링해 책 패널에 그리고, 끝나면 결과를 세션에 옮김"""
+    job = JOBS.get(st.session_state.final_job)
+    if job is None:
+        st.session_state.final_job = None
+        st.rerun()
+
+    st.markdown("<div style='height: 20px;'></div>", unsafe_allow_html=True)
+    st.markdown("<h2 style='text-align:center; color:#FF9EAA; font-size:2.5rem; margin-bottom:30px;'>📖 포동이가 책을 엮고 있어요...</h2>", unsafe_allow_html=True)
+
+    c1, c2 = st.columns([1.5, 1], gap="large")
+    with c1:
+        partial = FinalStory.from_partial(job.text)
+        st.markdown(render_book(partial.title, partial.story), unsafe_allow_html=True)
+    with c2:
+        st.markdown("### 🎧 들어보기")
+        if job.meta.get("stage") == "tts": st.info("🎙️ 목소리 입히는 중...")
+        else: st.info("이야기를 다 쓰면 목소리를 입혀요.")
+
+    if job.finished:
+        AppState.apply_final_job(job)
+        st.rerun()
+
+def start_export_job(fmt):
+    """세션에 있는 인코딩된 JPEG/MP3를 참조만 넘겨 작업자에서 파일을 기록"""
+    cards, storage = list(st.session_state.story_cards), st.session_state.image_storage
+    book = Storybook(story=st.session_state.final_story, cards=cards,
+                     images={c.image_key: storage.get(c.image_key) for c in cards if c.image_key in storage},
+                     audio=st.session_state.final_audio_data)
+    job = JOBS.submit("export", lambda job: run_export_job(job, book, fmt), total=len(cards), format=fmt)
+    st.session_state.export_job = job.job_id
+
+@st.fragment(run_every=JOB_POLL_SEC)
+def export_job_view():
+    """파일을 만드는 동안만 폴링하고, 끝나면 전체를 다시 그려 내려받기 버튼을 보여줌"""
+    job = JOBS.get(st.session_state.export_job)
+    if job is None or job.finished: st.rerun()
+    st.progress(job.progress, text=f"📦 동화책 파일을 만드는 중... ({job.done}/{job.total})")
+
+def export_section():
+    fmt = st.radio("형식", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f]["label"], horizontal=True)
+    export = JOBS.get(st.session_state.export_job)
+    if export and not export.finished:
+        export_job_view()
+    elif export and export.status == "done" and export.meta.get("format") == fmt:
+        fp = export.result["file"]
+        fp.seek(0)
+        st.download_button(f"⬇️ 내려받기 ({export.result['size'] / 2**20:.1f}MB)", fp.read(),
+                           file_name=export.result["name"], mime=export.result["mime"])
+    else:
+        if export and export.status == "error" and export.meta.get("format") == fmt: st.error(f"파일을 만들지 못했어요: {export.error}")
+        if st.button("📦 동화책 파일 만들기"):
+            start_export_job(fmt)
+            st.rerun()
+
+def final_view():
+    # 1. 아직 이야기가 없으면 작업자에서 스트리밍으로 생성하고 폴링
+    if not st.session_state.final_story:
+        if not st.session_state.final_job: start_final_job()
+        final_job_view()
+        return
+
+    # 2. 화면 렌더링 (작업에서 한 번 파싱한 FinalStory를 그대로 사용)
+    story = st.session_state.final_story
+    st.markdown("<div style='height: 20px;'></div>", unsafe_allow_html=True)
+    st.markdown("<h2 style='text-align:center; color:#FF9EAA; font-size:2.5rem; margin-bottom:30px;'>🎉 동화책이 완성되었어요!</h2>", unsafe_allow_html=True)
+    
+    c1, c2 = st.columns([1.5, 1], gap="large")
+    
+    # [왼쪽] 책 모양 디자인
+    with c1:
+        st.markdown(render_book(story.title, story.story), unsafe_allow_html=True)
     
     # [오른쪽] 오디오 및 버튼
     with c2:
@@ -198,23 +326,41 @@ def final_view():
             st.audio(st.session_state.final_audio_data, format="audio/mp3")
         
         st.markdown("### 💾 저장하기")
-        # 다운로드 버튼 기능 추가 (원하시면 HTML 다운로드 등 추가 가능)
+        export_section()
         if st.button("🏠 처음으로"): 
             st.session_state.clear()
+            st.query_params.clear()
             st.rerun()
 
+def debug_panel():
+    """?debug=1 일 때만 보이는 숨은 패널 (마지막 실행의 단계별 소요 시간)"""
+    with st.expander("🛠️ debug", expanded=False):
+        trace = st.session_state.last_trace
+        if trace:
+            st.markdown(f"**{trace.name}** run `{trace.run_id}` — {trace.seconds:.2f}s")
+            st.dataframe(trace.breakdown(), use_container_width=True)
+        else:
+            st.caption("아직 실행 기록이 없어요.")
+        if st.session_state.last_summary: st.json({"run_summary": st.session_state.last_summary})
+        st.json({"session": METRICS.session_memory().get(get_session_id(), {}), "scheduler": SCHEDULER.stats()})
+        st.code(METRICS.export_prometheus(), language="text")
+
 # ==============================================================================
 # MAIN ROUTING
 # ==============================================================================
 def main():
     inject_css()
     AppState.init()
+    AppState.reattach()
     
     if not st.session_state.generation_complete:
-        if st.session_state.mode is None:
+        if st.session_state.cards_job:
+            # 작업자에서 생성 중 (스크립트 스레드는 막지 않고 폴링만 함)
+            cards_job_view()
+        elif st.session_state.mode is None:
             landing_page()
         else:
-            if st.button("🏠 홈으로"): st.session_state.mode = None; st.rerun()
+            if st.button("🏠 홈으로"): st.session_state.mode = None; AppState.detach_jobs(); st.rerun()
             render_config()
             st.markdown("---")
             
@@ -225,14 +371,18 @@ def main():
                     
             elif st.session_state.mode == "camera":
                 # 👇 변경된 모듈에서 호출
-                captured_images = CameraManager.render_camera_ui()
+                captured_images = CameraManager.render_camera_ui(speculate=speculate_card)
                 if captured_images:
-                    process_images(captured_images)
+                    # 촬영 중 미리 시작한 카드는 남은 것만 기다림
+                    process_images(captured_images, prefetched=CameraManager.prefetched_jobs(st.session_state.story_config))
                     
     elif st.session_state.show_final:
         final_view()
     else:
         scene_view()
 
+    AppState.report_memory()
+    if st.query_params.get("debug") == "1": debug_panel()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+포동 생성 파이프라인 벤치마크 (네트워크/API 비용 없이 대체 백엔드로 실행)
+
+    python -m benchmarks.bench_pipeline --sizes 1 5 20 50 --latency 0.8 --jitter 0.3
+
+- cards : process_images와 같은 흐름 (사진 전처리 → 카드 생성)
+- final : final_view와 같은 흐름 (최종 동화 스트리밍 → TTS)
+사진 수별로 처리량, 항목 지연 p50/p95, 최대 메모리(파이썬 객체: tracemalloc / 프로세스: 최대 RSS),
+카드 입력 토큰(사진당 / 캐시된 비율)을 출력합니다. 카드 흐름은 거의 같은 사진 묶기를 끄고 사진마다 호출합니다.
+--no-prefix-reuse로 지시문을 매 요청에 붙이던 방식과 비교할 수 있습니다.
+cached%는 --context-cache explicit이고 지시문이 최소 캐시 크기 이상일 때만 0이 아닙니다
+(기본 system 방식은 시스템 지시 토큰도 매 요청 과금되므로 Gemini도 0을 보고함).
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import make_photos, pct, peak_rss_bytes, reset_peak_rss, rss_bytes
+from phodong_backends import FakeLLMBackend, FakeTTSBackend, RequestScheduler, CONTEXT_CACHE
+from phodong_upload import (
+    StoryConfig, LLMService, AudioService, ImagePipeline,
+    DEFAULT_CONCURRENCY, DEFAULT_BATCH_SIZE, ENGINE_OPTIONS
+)
+
+def run_cards(llm, photos, config, engine, concurrency, batch_size):
+    """(항목별 완료 지연 목록, 전체 소요 시간)"""
+    latencies = []
+    start = time.perf_counter()
+    images = [ImagePipeline.prepare(b) for b in photos]
+    kwargs = {"batch_size": batch_size} if engine == "batch" else {}
+
+    def on_progress(done, total):
+        now = time.perf_counter() - start
+        latencies.extend([now] * (done - len(latencies)))
+
+    # 묶기가 켜져 있으면 호출 수가 사진 수보다 줄어 카드 파이프라인 자체를 재지 못하므로 끔
+    cards = llm.generate_cards(images, config, engine=engine, concurrency=concurrency, dedupe_distance=-1,
+                               on_progress=on_progress, use_cache=False, **kwargs)
+    return latencies, time.perf_counter() - start, cards
+
+def run_final(llm, cards, config):
+    """(첫 조각까지 시간, 전체 소요 시간)"""
+    start = time.perf_counter()
+    first, text, complete = None, "", True
+    try:
+        for chunk in llm.generate_final_story_stream(cards, config):
+            if first is None: first = time.perf_counter() - start
+            text += chunk
+    except Exception: complete = False
+    AudioService.create(llm.parse_final_story(text, cards, config, complete=complete).text)
+    return first or 0.0, time.perf_counter() - start
+
+def measure(fn, *args):
+    """(결과, tracemalloc 최대치, 실행 중 프로세스 최대 RSS)"""
+    reset_peak_rss()
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak, peak_rss_bytes()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 20, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engine", choices=ENGINE_OPTIONS, default="concurrent")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--latency", type=float, default=0.5, help="대체 LLM 호출당 평균 지연(초)")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=0, help="스케줄러 분당 요청 수 (0이면 제한 없음)")
+    parser.add_argument("--max-in-flight", type=int, default=64)
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--photo-size", type=int, nargs=2, default=[3024, 4032])
+    parser.add_argument("--context-cache", choices=["system", "explicit"], default=CONTEXT_CACHE)
+    parser.add_argument("--no-prefix-reuse", action="store_true", help="카드 지시문을 시스템 지시로 분리하지 않고 매 요청에 붙임")
+    args = parser.parse_args(argv)
+
+    llm = LLMService(backend=FakeLLMBackend(args.latency, args.jitter, args.failure_rate, seed=1, context_cache=args.context_cache),
+                     scheduler=RequestScheduler(rpm=args.rpm, max_in_flight=args.max_in_flight, base_delay=0.1),
+                     prefix_reuse=not args.no_prefix_reuse)
+    AudioService.backend = FakeTTSBackend(args.tts_latency, args.jitter / 2, args.failure_rate, seed=2)
+    config = StoryConfig(child_name="포동", partner_name="토끼", age="5")
+
+    print(f"engine={args.engine} concurrency={args.concurrency} latency={args.latency}s±{args.jitter} failure_rate={args.failure_rate} prefix_reuse={llm.prefix_reuse} context_cache={args.context_cache}")
+    header = f"{'flow':<6} {'images':>6} {'runs':>4} {'img/s':>8} {'p50(s)':>8} {'p95(s)':>8} {'wall(s)':>8} {'py(MB)':>7} {'rss(MB)':>8} {'tok/img':>8} {'cached%':>8}"
+    print(header)
+    print("-" * len(header))
+
+    base_rss = rss_bytes()
+    for n in args.sizes:
+        photos = make_photos(n, tuple(args.photo_size), seed=n)
+        card_lat, card_wall, card_peak, card_rss = [], [], 0, 0
+        final_first, final_wall, final_peak, final_rss = [], [], 0, 0
+        cards, tokens, cached = [], 0, 0
+        for _ in range(args.repeat):
+            (lat, wall, cards), peak, rss = measure(run_cards, llm, photos, config, args.engine, args.concurrency, args.batch_size)
+            card_lat += lat; card_wall.append(wall); card_peak = max(card_peak, peak); card_rss = max(card_rss, rss)
+            tokens += llm.last_summary["prompt_tokens"]; cached += llm.last_summary["cached_tokens"]
+
+            AudioService._cache.clear()  # 반복 실행 시 TTS 캐시 적중 제외
+            (first, wall), peak, rss = measure(run_final, llm, cards, config)
+            final_first.append(first); final_wall.append(wall); final_peak = max(final_peak, peak); final_rss = max(final_rss, rss)
+
+        mean_wall = sum(card_wall) / len(card_wall)
+        print(f"{'cards':<6} {n:>6} {args.repeat:>4} {n / mean_wall:>8.2f} {pct(card_lat, 50):>8.3f} {pct(card_lat, 95):>8.3f} {mean_wall:>8.3f} {card_peak / 2**20:>7.1f} {card_rss / 2**20:>8.1f} {tokens / (n * args.repeat):>8.0f} {100 * cached / max(tokens, 1):>7.1f}%")
+        mean_wall = sum(final_wall) / len(final_wall)
+        print(f"{'final':<6} {n:>6} {args.repeat:>4} {n / mean_wall:>8.2f} {pct(final_first, 50):>8.3f} {pct(final_wall, 95):>8.3f} {mean_wall:>8.3f} {final_peak / 2**20:>7.1f} {final_rss / 2**20:>8.1f}")
+    print(f"scheduler: {llm.scheduler.stats()}")
+    print("* cards p50/p95: 사진별 카드 완료 지연, final p50: 첫 글자까지 시간, final p95: 전체 소요 시간")
+    print(f"* py(MB): 파이썬 객체 최대치(tracemalloc), rss(MB): C 확장(PIL 픽셀 버퍼 등)까지 포함한 프로세스 최대 RSS (시작 시 {base_rss / 2**20:.1f}MB)")
+    print("* tok/img: 카드 요청의 사진당 입력 토큰, cached%: 그중 명시적 컨텍스트 캐시에서 읽어 할인된 비율 (system 방식은 0%)")
+
+if __name__ == "__main__":
+    main()
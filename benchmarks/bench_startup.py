@@ -0,0 +1,130 @@
+"""
+포동 콜드 스타트 벤치마크 (새 프로세스마다 임포트 시간과 첫 화면까지의 시간을 잼)
+
+    python -m benchmarks.bench_startup --repeat 5
+    python -m benchmarks.bench_startup --preload     # 예전처럼 SDK를 미리 불러온 경우와 비교
+    python -m benchmarks.bench_startup --top 15      # -X importtime으로 무거운 패키지 목록
+
+- import : 앱 모듈을 차례로 임포트하는 데 걸린 시간 (각 모듈은 앞 모듈에 더해진 증분)
+- render : streamlit.testing AppTest로 app.py를 한 번 실행해 landing_page가 그려지기까지의 시간
+첫 화면까지 google.generativeai / gtts / dotenv가 불러와지지 않았는지도 함께 확인합니다.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+APP_MODULES = ["streamlit", "phodong_metrics", "phodong_backends", "phodong_upload", "phodong_export", "phodong_jobs", "phodong_live"]
+HEAVY_MODULES = ["google.generativeai", "gtts", "dotenv"]   # 첫 사용 때까지 미뤄야 하는 모듈
+
+PRELOAD = """
+t = time.perf_counter()
+for name in HEAVY:
+    try: importlib.import_module(name)
+    except ImportError: pass
+result["preload"] = time.perf_counter() - t
+"""
+
+IMPORT_SNIPPET = """
+import sys, time, json, importlib
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+HEAVY, result = {heavy!r}, {{"modules": {{}}}}
+{preload}
+for name in {modules!r}:
+    t = time.perf_counter()
+    importlib.import_module(name)
+    result["modules"][name] = time.perf_counter() - t
+result["total"] = time.perf_counter() - start
+result["loaded"] = [m for m in HEAVY if m in sys.modules]
+print(json.dumps(result))
+"""
+
+RENDER_SNIPPET = """
+import sys, time, json, importlib
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+HEAVY, result = {heavy!r}, {{}}
+{preload}
+t = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+result["import_streamlit"] = time.perf_counter() - t
+t = time.perf_counter()
+at = AppTest.from_file({app!r}, default_timeout={timeout!r})
+at.run()
+result["first_render"] = time.perf_counter() - t
+result["total"] = time.perf_counter() - start
+result["landing"] = any(b.label == "앨범 업로드" for b in at.button)
+result["errors"] = [e.value for e in at.exception]
+result["loaded"] = [m for m in HEAVY if m in sys.modules]
+print(json.dumps(result, ensure_ascii=False))
+"""
+
+def run_child(code: str, timeout: float) -> dict:
+    """새 인터프리터에서 실행한 결과 dict (process: 인터프리터 시작부터 끝까지의 시간)"""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=timeout)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0: raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "child failed")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["process"] = wall
+    return result
+
+def importtime_top(n: int, timeout: float) -> list:
+    """-X importtime 출력에서 누적 시간이 큰 최상위 패키지 n개 [(이름, 누적 ms)]"""
+    code = f"import sys; sys.path.insert(0, {ROOT!r}); " + "; ".join(f"import {m}" for m in APP_MODULES)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=timeout)
+    if proc.returncode != 0: raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in proc.stderr.splitlines():
+        parts = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit(): continue
+        name = parts[2][1:]
+        if name.startswith(" ") or "." in name: continue   # 들여쓰기 없는 최상위 패키지만
+        rows.append((name, int(parts[1]) / 1000))
+    return sorted(rows, key=lambda r: -r[1])[:n]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--preload", action="store_true", help="앱 모듈보다 먼저 google.generativeai / gtts / dotenv를 임포트 (예전 동작)")
+    parser.add_argument("--top", type=int, default=0, help="-X importtime 기준 무거운 최상위 패키지 n개 출력")
+    args = parser.parse_args(argv)
+
+    preload = PRELOAD if args.preload else ""
+    import_code = IMPORT_SNIPPET.format(root=ROOT, heavy=HEAVY_MODULES, modules=APP_MODULES, preload=preload)
+    render_code = RENDER_SNIPPET.format(root=ROOT, heavy=HEAVY_MODULES, app=APP_PATH, timeout=args.timeout, preload=preload)
+
+    imports = [run_child(import_code, args.timeout) for _ in range(args.repeat)]
+    renders = [run_child(render_code, args.timeout) for _ in range(args.repeat)]
+
+    print(f"python={sys.version.split()[0]} repeat={args.repeat} preload={args.preload}")
+    header = f"{'stage':<24} {'median(ms)':>11} {'min(ms)':>9}"
+    print(header)
+    print("-" * len(header))
+    def row(label, values):
+        print(f"{label:<24} {median(values) * 1000:>11.1f} {min(values) * 1000:>9.1f}")
+    if args.preload: row("preload SDKs", [r["preload"] for r in imports])
+    for name in APP_MODULES: row(f"import {name}", [r["modules"][name] for r in imports])
+    row("import total", [r["total"] for r in imports])
+    row("import process", [r["process"] for r in imports])
+    row("render: streamlit", [r["import_streamlit"] for r in renders])
+    row("render: landing_page", [r["first_render"] for r in renders])
+    row("render: total", [r["total"] for r in renders])
+    row("render: process", [r["process"] for r in renders])
+
+    loaded = sorted({m for r in imports + renders for m in r["loaded"]})
+    print(f"landing rendered: {all(r['landing'] for r in renders)}  errors: {sum(len(r['errors']) for r in renders)}")
+    print(f"heavy modules loaded before first use: {loaded or 'none'}")
+    if args.top:
+        print(f"\n{'package':<24} {'cumulative(ms)':>15}")
+        for name, ms in importtime_top(args.top, args.timeout): print(f"{name:<24} {ms:>15.1f}")
+
+if __name__ == "__main__":
+    main()
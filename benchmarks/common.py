@@ -0,0 +1,58 @@
+"""
+벤치마크 공용 도우미 (앱 모듈을 임포트하지 않으므로 환경 변수를 정하기 전에 불러도 됨)
+"""
+import io
+import random
+import resource
+from statistics import quantiles
+
+from PIL import Image, ImageDraw
+
+def make_photos(n: int, size=(3024, 4032), seed: int = 0) -> list:
+    """휴대폰 사진 크기의 서로 다른 JPEG 바이트 n개 (그라데이션 배경 + 도형이라 dHash도 서로 다름)"""
+    rng = random.Random(seed)
+    photos = []
+    for _ in range(n):
+        w, h = size
+        top, bottom = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(2)]
+        img = Image.linear_gradient("L").resize(size).convert("RGB")
+        img = Image.composite(Image.new("RGB", size, bottom), Image.new("RGB", size, top), img.convert("L"))
+        draw = ImageDraw.Draw(img)
+        for _ in range(rng.randint(4, 9)):
+            x, y = rng.randrange(w), rng.randrange(h)
+            r = rng.randint(w // 12, w // 3)
+            shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+            shape((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+        img = Image.blend(img, Image.effect_noise(size, 40).convert("RGB"), 0.15)   # 센서 노이즈 정도의 질감
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=90)
+        photos.append(buf.getvalue())
+    return photos
+
+def pct(values, q):
+    if not values: return 0.0
+    if len(values) == 1: return values[0]
+    return quantiles(values, n=100, method="inclusive")[q - 1]
+
+def read_status_kb(field: str) -> int:
+    """/proc/self/status의 메모리 항목(kB). 리눅스가 아니면 0"""
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith(field + ":"): return int(line.split()[1])
+    except OSError: pass
+    return 0
+
+def peak_rss_bytes() -> int:
+    """프로세스 최대 RSS (PIL 픽셀 버퍼처럼 C에서 잡는 메모리도 포함)"""
+    return read_status_kb("VmHWM") * 1024 or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def reset_peak_rss():
+    """최대 RSS 기록을 현재 RSS로 되돌림 (리눅스 clear_refs, 안 되면 프로세스 전체 최대값이 그대로 남음)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as fp: fp.write("5")
+    except OSError: pass
+
+def rss_bytes() -> int:
+    """현재 RSS (리눅스가 아니면 최대 RSS로 대신함)"""
+    return read_status_kb("VmRSS") * 1024 or peak_rss_bytes()
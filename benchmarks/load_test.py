@@ -0,0 +1,192 @@
+"""
+포동 다중 세션 부하 테스트 (streamlit.testing AppTest로 app.main을 직접 구동)
+
+    python -m benchmarks.load_test --sessions 20 --photos 5 --latency 0.8
+
+세션마다 실제 흐름을 그대로 밟습니다: 첫 화면 → 앨범 업로드/카메라 → 장면 넘기기 → 완성.
+카메라 세션은 사진을 한 장씩 찍어 촬영 직후의 미리 생성 경로까지 거칩니다.
+사진마다 카드 호출이 한 번씩 나가도록 거의 같은 사진 묶기는 끕니다 (--dedupe로 켬).
+LLM/TTS는 대체 백엔드(PHODONG_BACKEND=fake)로 돌고, 다음을 출력합니다.
+- 단계별/세션별 지연 p50/p95
+- 세션당 카드 묶음 수 / 사진 수, 카메라 세션에서 미리 생성된 사진 수
+- 최대 RSS 증가량
+- st.session_state.clear() ("🏠 처음으로") 뒤에도 세션당 남아 있는 메모리 (작업 테이블 포함/제외)
+"""
+import os
+import io
+import gc
+import sys
+import time
+import argparse
+import threading
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+APP_PATH = os.path.join(ROOT, "app.py")
+
+from benchmarks.common import make_photos, pct, peak_rss_bytes, reset_peak_rss, rss_bytes
+
+# AppTest.run은 전역 Runtime._instance를 바꿨다가 되돌리므로 스크립트 실행은 한 번에 하나만.
+# 세션들은 작업자에서 도는 생성 작업과 폴링 대기에서 겹칩니다 (실제 서버에서 병목이 되는 부분).
+APPTEST_LOCK = threading.Lock()
+
+class UploadedPhoto(io.BytesIO):
+    """st.file_uploader가 돌려주는 UploadedFile 대신 쓰는 객체"""
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+
+def patch_file_uploader(photos: list):
+    """AppTest는 file_uploader를 지원하지 않으므로 모든 세션이 같은 사진 묶음을 업로드한 것처럼 바꿈"""
+    import streamlit as st
+    st.file_uploader = lambda *args, **kwargs: [UploadedPhoto(b, f"photo_{i}.jpg") for i, b in enumerate(photos)]
+
+def run(at, timeout: float):
+    with APPTEST_LOCK: return at.run(timeout=timeout)
+
+def patch_camera_input():
+    """AppTest는 camera_input도 지원하지 않으므로 세션 상태의 load_test_shots를 실행마다 한 장씩 찍은 것처럼 돌려줌
+    (실제 위젯처럼 마지막 사진은 이후 실행에도 계속 돌려주고, 앱의 digest 중복 검사가 걸러냄)"""
+    import streamlit as st
+    def camera_input(*args, **kwargs):
+        shots = st.session_state.get("load_test_shots")
+        if not shots: return None
+        i = min(st.session_state.get("load_test_shot_idx", 0), len(shots) - 1)
+        st.session_state.load_test_shot_idx = i + 1
+        return UploadedPhoto(shots[i], f"shot_{i}.jpg")
+    st.camera_input = camera_input
+
+def click(at, label: str, timeout: float):
+    for b in at.button:
+        if b.label == label:
+            b.click()
+            return run(at, timeout)
+    raise LookupError(f"button not found: {label}")
+
+def wait_for(at, predicate, timeout: float, poll: float):
+    """작업자에서 도는 생성 작업을 폴링 (실제 앱에서는 st.fragment가 하는 일)"""
+    deadline = time.monotonic() + timeout
+    while not predicate(at):
+        if time.monotonic() > deadline: raise TimeoutError("generation did not finish in time")
+        time.sleep(poll)
+        run(at, timeout)
+
+def run_session(idx: int, mode: str, photos: list, args) -> dict:
+    from streamlit.testing.v1 import AppTest
+
+    timings, speculated = {}, None
+    start = time.perf_counter()
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+
+    t = time.perf_counter()
+    run(at, args.timeout)
+    timings["landing"] = time.perf_counter() - t
+
+    # 캐시 적중 없이 매번 생성하도록 (같은 사진을 모든 세션이 쓰므로)
+    at.session_state["fresh_story"] = True
+    t = time.perf_counter()
+    if mode == "upload":
+        click(at, "앨범 업로드", args.timeout)
+        click(at, "만들기", args.timeout)
+    else:
+        click(at, "카메라 촬영", args.timeout)
+        # 한 장씩 찍음 (찍을 때마다 render_camera_ui가 speculate_card로 카드 생성을 미리 시작)
+        at.session_state["load_test_shots"] = photos
+        while len(at.session_state["camera_captures"]) < len(photos): run(at, args.timeout)
+        speculated = len(at.session_state["camera_jobs"])
+        click(at, "✨ 이야기 만들기", args.timeout)
+    wait_for(at, lambda a: a.session_state["generation_complete"], args.timeout, args.poll)
+    timings["cards"] = time.perf_counter() - t
+    groups = at.session_state["last_summary"].get("groups", 0)
+
+    flips = []
+    for _ in range(len(at.session_state["story_cards"]) - 1):
+        t = time.perf_counter()
+        click(at, "다음 ➡️", args.timeout)
+        flips.append(time.perf_counter() - t)
+    timings["scene_flip"] = sum(flips) / len(flips) if flips else 0.0
+
+    t = time.perf_counter()
+    click(at, "✨ 완성하기", args.timeout)
+    wait_for(at, lambda a: a.session_state["final_story"], args.timeout, args.poll)
+    timings["final"] = time.perf_counter() - t
+
+    errors = [e.value for e in at.exception]
+    click(at, "🏠 처음으로", args.timeout)
+    timings["session"] = time.perf_counter() - start
+    del at
+    return {"idx": idx, "mode": mode, "timings": timings, "errors": errors, "groups": groups, "speculated": speculated}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=0, help="동시에 진행하는 세션 수 (0이면 전부 동시에)")
+    parser.add_argument("--photos", type=int, default=5, help="세션당 사진 수")
+    parser.add_argument("--latency", type=float, default=0.5, help="대체 LLM/TTS 호출당 평균 지연(초)")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--poll", type=float, default=0.2)
+    parser.add_argument("--dedupe", action="store_true", help="거의 같은 사진 묶기를 켬 (기본은 꺼서 사진마다 카드 호출)")
+    args = parser.parse_args(argv)
+
+    # 앱 모듈을 읽기 전에 대체 백엔드를 지정
+    os.environ["PHODONG_BACKEND"] = "fake"
+    os.environ.setdefault("PHODONG_RPM", "0")
+    os.environ["PHODONG_FAKE_LATENCY"] = str(args.latency)
+    os.environ["PHODONG_FAKE_JITTER"] = str(args.jitter)
+    os.environ["PHODONG_FAKE_FAILURE_RATE"] = str(args.failure_rate)
+    if not args.dedupe: os.environ["PHODONG_DEDUPE_DISTANCE"] = "-1"
+
+    photos = make_photos(args.photos, (1600, 1200), seed=0)
+    patch_file_uploader(photos)
+    patch_camera_input()
+
+    # 첫 세션 하나로 모듈 임포트/캐시를 데운 뒤 기준점을 잡음
+    run_session(-1, "upload", photos, args)
+    from phodong_jobs import JOBS
+    gc.collect()
+    tracemalloc.start()
+    base_traced, base_rss = tracemalloc.get_traced_memory()[0], rss_bytes()
+    reset_peak_rss()
+
+    modes = ["upload" if i % 2 == 0 else "camera" for i in range(args.sessions)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency or args.sessions) as pool:
+        results = list(pool.map(lambda i: run_session(i, modes[i], photos, args), range(args.sessions)))
+    wall = time.perf_counter() - started
+
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - base_traced
+    peak_rss = peak_rss_bytes()   # 기준점 이후 최대 RSS (VmHWM)
+    # 작업 테이블의 결과는 TTL 동안 남으므로 비운 뒤 한 번 더 측정
+    JOBS.ttl, jobs_held = 0, JOBS.stats()["jobs"]
+    JOBS.get("-")
+    gc.collect()
+    retained_no_jobs = tracemalloc.get_traced_memory()[0] - base_traced
+    tracemalloc.stop()
+
+    by_stage = defaultdict(list)
+    for r in results:
+        for stage, v in r["timings"].items(): by_stage[stage].append(v)
+    errors = [e for r in results for e in r["errors"]]
+
+    print(f"sessions={args.sessions} concurrency={args.concurrency or args.sessions} photos={args.photos} latency={args.latency}s±{args.jitter}")
+    print(f"{'stage':<12} {'p50(s)':>8} {'p95(s)':>8} {'max(s)':>8}")
+    for stage in ["landing", "cards", "scene_flip", "final", "session"]:
+        values = by_stage[stage]
+        print(f"{stage:<12} {pct(values, 50):>8.3f} {pct(values, 95):>8.3f} {max(values, default=0):>8.3f}")
+    print(f"wall={wall:.2f}s  sessions/min={args.sessions / wall * 60:.1f}")
+    print(f"rss: {base_rss / 2**20:.1f}MB -> peak {peak_rss / 2**20:.1f}MB (+{(peak_rss - base_rss) / 2**20:.1f}MB)")
+    print(f"retained after session_state.clear(): {retained / args.sessions / 1024:.1f}KB/session "
+          f"(job table {jobs_held} jobs) / {retained_no_jobs / args.sessions / 1024:.1f}KB/session without job table")
+    camera = [r for r in results if r["mode"] == "camera"]
+    print(f"card groups/session: {sum(r['groups'] for r in results) / len(results):.1f} of {args.photos} photos (dedupe={'on' if args.dedupe else 'off'})"
+          + (f"  camera: {sum(r['speculated'] for r in camera)}/{len(camera) * args.photos} shots speculated" if camera else ""))
+    if errors: print(f"errors ({len(errors)}): {errors[:3]}")
+
+if __name__ == "__main__":
+    main()
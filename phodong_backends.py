@@ -0,0 +1,490 @@
+import os
+import io
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, Iterator, Dict, Tuple
+
+from PIL import Image
+
+from phodong_metrics import METRICS
+
+logger = logging.getLogger("PhodongCore")
+
+# 상수
+DEFAULT_MODEL = "gemini-2.0-flash"
+BACKEND_NAME = os.getenv("PHODONG_BACKEND", "gemini")   # "gemini" | "fake"
+SCHEDULER_RPM = float(os.getenv("PHODONG_RPM", "60"))                 # 프로세스 전체 분당 요청 수 (0 이하면 제한 없음)
+SCHEDULER_MAX_IN_FLIGHT = int(os.getenv("PHODONG_MAX_IN_FLIGHT", "8"))  # 동시에 진행 중인 호출 수 상한
+SCHEDULER_MAX_RETRIES = 4
+SCHEDULER_BASE_DELAY = 1.0                                            # 재시도 지연 (지수 증가, 초)
+SCHEDULER_MAX_DELAY = 30.0
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded"}
+# 시스템 지시 재사용 방식: "system"은 설정별 모델만 재사용하고 시스템 지시 토큰은 매 요청 그대로 과금됨,
+# "explicit"은 CachedContent로 올려 캐시 토큰 할인을 받음 (지시문이 최소 캐시 크기 이상일 때만, 아니면 system으로 대신함)
+CONTEXT_CACHE = os.getenv("PHODONG_CONTEXT_CACHE", "system")
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("PHODONG_CONTEXT_CACHE_MIN_TOKENS", "4096"))   # 명시적 캐시의 최소 토큰 수 (모델마다 다름)
+CONTEXT_CACHE_TTL_SEC = int(os.getenv("PHODONG_CONTEXT_CACHE_TTL", "3600"))
+CONTEXT_CACHE_MAX_ITEMS = 64                                          # 시스템 지시(= StoryConfig)별 모델/캐시 보관 수
+SAFETY_SETTINGS = [{"category": c, "threshold": "BLOCK_NONE"} for c in ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]]
+
+_runtime_ready = False
+_runtime_lock = threading.Lock()
+
+def init_runtime():
+    """.env 로드 + 로깅 설정 (첫 화면에는 필요 없으므로 키/백엔드를 처음 쓸 때 한 번만 실행)"""
+    global _runtime_ready
+    with _runtime_lock:
+        if _runtime_ready: return
+        from dotenv import load_dotenv
+        load_dotenv()
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+        _runtime_ready = True
+
+def _import_genai():
+    """google.generativeai는 임포트만으로 수백 ms가 들어 Gemini 백엔드를 처음 만들 때 불러옴"""
+    import google.generativeai as genai
+    return genai
+
+@dataclass
+class LLMResponse:
+    text: str = ""
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0      # prompt_tokens 중 명시적 컨텍스트 캐시에서 읽어 할인된 토큰 (system 방식은 항상 0)
+
+class BackendError(Exception):
+    """백엔드 호출 실패 (code는 HTTP 상태 코드와 같은 의미)"""
+    def __init__(self, message: str, code: int = 500):
+        super().__init__(message)
+        self.code = code
+
+class FakeLatency:
+    """대체 백엔드의 지연/흔들림/실패를 시드 기반으로 재현"""
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.latency, self.jitter, self.failure_rate = latency, jitter, failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, scale: float = 1.0):
+        with self._lock:
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)) * scale
+            fail = self._rng.random() < self.failure_rate
+        if delay: time.sleep(delay)
+        if fail: raise BackendError("fake backend: simulated failure", code=503)
+
+class PrefixTable:
+    """시스템 지시 본문 다이제스트 → 값 (TTL + LRU). 같은 설정의 요청은 같은 항목을 다시 씀"""
+    def __init__(self, ttl: float = CONTEXT_CACHE_TTL_SEC, max_items: int = CONTEXT_CACHE_MAX_ITEMS):
+        self.ttl, self.max_items = ttl, max_items
+        self._items: "OrderedDict[str, Tuple[float, Future]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(system_instruction: str) -> str:
+        return hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()
+
+    def get_or_create(self, system_instruction: str, create) -> Tuple[object, bool]:
+        """(값, 새로 만들었는지). 만료된 항목은 다시 만듦
+
+        create(네트워크 호출일 수 있음)는 잠금 밖에서 실행하고, 같은 지시문을 동시에 요청한 쪽은
+        그 항목의 Future만 기다림 (다른 설정의 요청은 막지 않고, 같은 캐시를 두 번 만들지도 않음)
+        """
+        key = self.key(system_instruction)
+        with self._lock:
+            now = time.monotonic()
+            entry = self._items.get(key)
+            hit = bool(entry and entry[0] > now)
+            if hit: slot = entry[1]
+            else:
+                slot = Future()
+                self._items[key] = (now + self.ttl, slot)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items: self._items.popitem(last=False)
+        if hit: return slot.result(), False
+        try: value = create(system_instruction)
+        except Exception as e:
+            # 실패한 항목은 지워 다음 요청이 다시 만들게 함
+            with self._lock:
+                if self._items.get(key, (0, None))[1] is slot: del self._items[key]
+            slot.set_exception(e)
+            raise
+        slot.set_result(value)
+        return value, True
+
+# ==============================================================================
+# LLM BACKENDS
+# ==============================================================================
+class LLMBackend:
+    """LLMService가 사용하는 생성 백엔드 인터페이스"""
+    name = "base"
+
+    def generate(self, contents, response_mime_type: str = "application/json", response_schema: Optional[dict] = None,
+                 system_instruction: Optional[str] = None) -> LLMResponse:
+        """response_schema: 응답 JSON 스키마 (OpenAPI 부분집합, 지원하지 않는 백엔드는 무시)
+        system_instruction: 요청마다 같은 앞부분 지시문 (백엔드가 설정별로 한 번만 올려두고 재사용)
+        """
+        raise NotImplementedError
+
+    def generate_stream(self, contents, response_mime_type: str = "text/plain", response_schema: Optional[dict] = None,
+                        system_instruction: Optional[str] = None) -> Iterator[str]:
+        yield self.generate(contents, response_mime_type=response_mime_type, response_schema=response_schema,
+                            system_instruction=system_instruction).text
+
+def _has_ordering(schema: Optional[dict]) -> bool:
+    if not schema: return False
+    return "propertyOrdering" in schema or _has_ordering(schema.get("items")) \
+        or any(_has_ordering(v) for v in schema.get("properties", {}).values())
+
+def _map_ordering(schema: dict, keep: bool) -> dict:
+    """propertyOrdering을 SDK proto 필드명(property_ordering)으로 바꾸거나 (keep=True) 빼낸 사본"""
+    out = {k: v for k, v in schema.items() if k != "propertyOrdering"}
+    if keep and "propertyOrdering" in schema: out["property_ordering"] = list(schema["propertyOrdering"])
+    if "properties" in schema: out["properties"] = {k: _map_ordering(v, keep) for k, v in schema["properties"].items()}
+    if "items" in schema: out["items"] = _map_ordering(schema["items"], keep)
+    return out
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key=None, model_name: str = DEFAULT_MODEL, context_cache: str = CONTEXT_CACHE):
+        self.api_key = api_key if api_key else os.getenv("GOOGLE_API_KEY")
+        if not self.api_key: raise ValueError("API Key가 없습니다.")
+        self.genai = genai = _import_genai()
+        genai.configure(api_key=self.api_key)
+
+        self.model_name = model_name
+        self.context_cache = context_cache
+        self.schema_ordering = "property_ordering" in genai.protos.Schema.meta.fields
+        self.generation_config = genai.types.GenerationConfig(
+            temperature=1.0,
+            response_mime_type="application/json"
+        )
+        self.model = genai.GenerativeModel(model_name, generation_config=self.generation_config)
+        # 서버 쪽 캐시가 먼저 만료되지 않도록 로컬 항목은 조금 일찍 버림
+        self._prefixes = PrefixTable(ttl=CONTEXT_CACHE_TTL_SEC * 0.9)
+
+    def _create_prefix_model(self, system_instruction: str):
+        if self.context_cache == "explicit":
+            try:
+                from google.generativeai import caching
+                cached = caching.CachedContent.create(model=self.model_name, system_instruction=system_instruction,
+                                                      ttl=timedelta(seconds=CONTEXT_CACHE_TTL_SEC))
+                return self.genai.GenerativeModel.from_cached_content(cached, generation_config=self.generation_config)
+            except Exception as e:
+                # 최소 토큰 수에 못 미치는 지시문 등은 시스템 지시로 대신함
+                logger.warning(f"Context Cache Fallback: {e}")
+        return self.genai.GenerativeModel(self.model_name, generation_config=self.generation_config, system_instruction=system_instruction)
+
+    def _model(self, system_instruction: Optional[str]):
+        if not system_instruction: return self.model
+        return self._prefixes.get_or_create(system_instruction, self._create_prefix_model)[0]
+
+    def _schema(self, schema: Optional[dict], stream: bool = False) -> Optional[dict]:
+        """propertyOrdering은 SDK의 Schema가 그 필드를 알 때만 보냄 (google-generativeai 0.8.x는 모르고 ValueError를 냄)
+
+        보낼 수 없을 때 순서가 중요한 스트리밍 요청은 스키마 없이 JSON 모드로만 보내 프롬프트의 키 순서를 따르게 함
+        (결과는 호출하는 쪽이 어차피 파싱/검증함). 스트리밍이 아닌 요청은 순서만 빼고 스키마를 그대로 씀
+        """
+        if not schema or not _has_ordering(schema): return schema
+        if self.schema_ordering: return _map_ordering(schema, keep=True)
+        return None if stream else _map_ordering(schema, keep=False)
+
+    def _config(self, response_mime_type, response_schema=None):
+        if response_schema: return self.genai.types.GenerationConfig(response_mime_type=response_mime_type, response_schema=response_schema)
+        return self.genai.types.GenerationConfig(response_mime_type=response_mime_type)
+
+    def generate(self, contents, response_mime_type: str = "application/json", response_schema: Optional[dict] = None,
+                 system_instruction: Optional[str] = None) -> LLMResponse:
+        response = self._model(system_instruction).generate_content(
+            contents, generation_config=self._config(response_mime_type, self._schema(response_schema)), safety_settings=SAFETY_SETTINGS)
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            text=response.text,
+            prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+            cached_tokens=getattr(usage, "cached_content_token_count", 0) or 0,
+        )
+
+    def generate_stream(self, contents, response_mime_type: str = "text/plain", response_schema: Optional[dict] = None,
+                        system_instruction: Optional[str] = None) -> Iterator[str]:
+        response = self._model(system_instruction).generate_content(
+            contents, stream=True, generation_config=self._config(response_mime_type, self._schema(response_schema, stream=True)),
+            safety_settings=SAFETY_SETTINGS)
+        for chunk in response:
+            try: piece = chunk.text
+            except ValueError: continue  # 텍스트가 없는 조각 (안전 필터 등)
+            if piece: yield piece
+
+class FakeLLMBackend(LLMBackend):
+    """네트워크 없이 형식이 맞는 카드/동화 JSON을 돌려주는 결정적 대체 백엔드 (지연/흔들림/실패율 조절 가능)"""
+    name = "fake"
+    NAMES = ["반짝이", "몽실이", "또롱이", "포근이", "씽씽이", "방울이", "콩콩이", "보들이"]
+    TYPES = ["장난감", "구름", "자동차", "꽃", "인형", "나무", "공룡", "로봇"]
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, seed: int = 0,
+                 cache_ttl: float = CONTEXT_CACHE_TTL_SEC, context_cache: str = CONTEXT_CACHE):
+        self.timing = FakeLatency(latency, jitter, failure_rate, seed)
+        # Gemini처럼 explicit 방식에서 지시문이 최소 캐시 크기 이상일 때만, 두 번째 요청부터 캐시 적중으로 셈
+        # (system 방식은 시스템 지시도 매 요청 과금되므로 cached_tokens는 0)
+        self.context_cache = context_cache
+        self._prefixes = PrefixTable(ttl=cache_ttl)
+
+    def _card(self, image: Image.Image, index: Optional[int] = None) -> dict:
+        seed = int(hashlib.sha256(image.tobytes()).hexdigest()[:8], 16)
+        name, kind = self.NAMES[seed % len(self.NAMES)], self.TYPES[(seed // 7) % len(self.TYPES)]
+        card = {
+            "character_name": name,
+            "character_type": kind,
+            "magic_power": "반짝이는 빛 만들기",
+            "personality": "호기심 많고 다정함",
+            "dialogue": f"안녕! 나는 {name}이야. 우리 같이 놀아요!",
+            "story_narration": f"그때였어요! 작은 {kind} {name}가 눈을 반짝이며 깨어났어요. {name}는 친구들에게 손을 흔들며 신나는 모험을 떠나자고 말했답니다.",
+        }
+        if index is not None: card["index"] = index
+        return card
+
+    def _story(self, contents, as_json: bool) -> str:
+        prompt = " ".join(c for c in contents if isinstance(c, str)) if isinstance(contents, list) else str(contents)
+        title = "포동이와 친구들의 반짝이는 하루"
+        body = "\n".join(["옛날 옛적, 작은 마을에 호기심 많은 아이가 살았어요."] * max(3, prompt.count("\n- ") * 2) + ["그렇게 모두 행복하게 잠들었답니다."])
+        return json.dumps({"title": title, "story": body}, ensure_ascii=False) if as_json else f"{title}\n{body}"
+
+    def generate(self, contents, response_mime_type: str = "application/json", response_schema: Optional[dict] = None,
+                 system_instruction: Optional[str] = None) -> LLMResponse:
+        self.timing.wait()
+        parts = contents if isinstance(contents, list) else [contents]
+        images = [p for p in parts if isinstance(p, Image.Image)]
+        # 스키마가 배열이면 사진이 한 장이어도 배열로 답함 (Gemini도 스키마 형식을 따름)
+        as_array = bool(response_schema) and response_schema.get("type") == "ARRAY"
+        if len(images) == 1 and not as_array: text = json.dumps(self._card(images[0]), ensure_ascii=False)
+        elif images: text = json.dumps([self._card(img, i) for i, img in enumerate(images)], ensure_ascii=False)
+        elif any(isinstance(p, str) and "character_name" in p for p in parts):
+            # 사진 없는 카드 요청 ('다음 장면' 카드 등)
+            text = json.dumps(self._card(Image.new("L", (1, 1), len(str(parts)) % 256)), ensure_ascii=False)
+        else: text = self._story(parts, as_json=response_mime_type == "application/json")
+        prompt_chars = sum(len(p) for p in parts if isinstance(p, str))
+        # 토큰 수는 글자 수/사진 수로 대략 흉내냄
+        system_tokens = cached_tokens = 0
+        if system_instruction:
+            system_tokens = len(system_instruction) // 2
+            if self.context_cache == "explicit" and system_tokens >= CONTEXT_CACHE_MIN_TOKENS:
+                if not self._prefixes.get_or_create(system_instruction, lambda _: True)[1]: cached_tokens = system_tokens
+        return LLMResponse(text=text, prompt_tokens=system_tokens + prompt_chars // 2 + 258 * len(images),
+                           output_tokens=len(text) // 2, cached_tokens=cached_tokens)
+
+    def generate_stream(self, contents, response_mime_type: str = "text/plain", response_schema: Optional[dict] = None,
+                        system_instruction: Optional[str] = None) -> Iterator[str]:
+        text = self._story(contents if isinstance(contents, list) else [contents], as_json=response_mime_type == "application/json")
+        self.timing.wait(scale=0.3)  # 첫 조각까지의 지연
+        for i in range(0, len(text), 40):
+            if i: self.timing.wait(scale=0.05)
+            yield text[i:i + 40]
+
+# ==============================================================================
+# TTS BACKENDS
+# ==============================================================================
+class TTSBackend:
+    """AudioService가 사용하는 음성 합성 백엔드 인터페이스"""
+    name = "base"
+
+    def synthesize(self, text: str, lang: str) -> bytes:
+        raise NotImplementedError
+
+class GTTSBackend(TTSBackend):
+    name = "gtts"
+
+    def synthesize(self, text: str, lang: str) -> bytes:
+        from gtts import gTTS  # 첫 낭독 때 불러옴
+        fp = io.BytesIO()
+        gTTS(text=text, lang=lang, slow=False).write_to_fp(fp)
+        return fp.getvalue()
+
+class FakeTTSBackend(TTSBackend):
+    """무음 MP3를 돌려주는 대체 백엔드 (글자 수에 비례한 길이)"""
+    name = "fake"
+    # MPEG-1 Layer III, 32kbps, 44.1kHz, mono 무음 프레임 (프레임당 약 26ms)
+    SILENT_FRAME = bytes([0xFF, 0xFB, 0x10, 0xC4]) + bytes(100)
+    SEC_PER_CHAR = 0.08
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.timing = FakeLatency(latency, jitter, failure_rate, seed)
+
+    def synthesize(self, text: str, lang: str) -> bytes:
+        self.timing.wait()
+        frames = max(1, int(len(text) * self.SEC_PER_CHAR / 0.026))
+        return self.SILENT_FRAME * frames
+
+# ==============================================================================
+# SCHEDULER
+# ==============================================================================
+def is_retryable(e: Exception) -> bool:
+    """429/5xx 계열 오류만 재시도"""
+    if type(e).__name__ in RETRYABLE_ERRORS: return True
+    code = getattr(e, "code", None)
+    if callable(code): return False
+    try: return int(code) in RETRYABLE_CODES
+    except (TypeError, ValueError): return False
+
+class RequestScheduler:
+    """프로세스 전체가 공유하는 호출 스케줄러
+
+    - 토큰 버킷으로 분당 요청 수 제한, 진행 중 호출 수 상한
+    - 세션별 대기열을 라운드 로빈으로 돌며 한 세션이 몰아 보내도 다른 세션이 밀리지 않게 함
+    - 429/5xx는 지터가 들어간 지수 백오프로 재시도
+    """
+
+    def __init__(self, rpm: float = SCHEDULER_RPM, max_in_flight: int = SCHEDULER_MAX_IN_FLIGHT,
+                 max_retries: int = SCHEDULER_MAX_RETRIES, base_delay: float = SCHEDULER_BASE_DELAY,
+                 max_delay: float = SCHEDULER_MAX_DELAY, burst: Optional[float] = None):
+        self.rate = rpm / 60.0 if rpm > 0 else 0.0
+        self.burst = burst if burst else max(1.0, float(max_in_flight))
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries, self.base_delay, self.max_delay = max_retries, base_delay, max_delay
+
+        self._cond = threading.Condition()
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._in_flight = 0
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._waits: deque = deque(maxlen=1000)
+        self.requests = self.retries = self.failures = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate: self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _ready(self, session_id: str, ticket) -> bool:
+        head = next(iter(self._queues))
+        return (head == session_id and self._queues[session_id][0] is ticket
+                and self._in_flight < self.max_in_flight and (not self.rate or self._tokens >= 1))
+
+    @contextmanager
+    def slot(self, session_id: str = "default"):
+        """차례가 오고 토큰/자리가 생길 때까지 기다린 뒤 한 건의 호출 자리를 잡음"""
+        ticket, enqueued = object(), time.monotonic()
+        with self._cond:
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._publish()
+            while True:
+                self._refill()
+                if self._ready(session_id, ticket): break
+                timeout = (1 - self._tokens) / self.rate if self.rate and self._tokens < 1 else 1.0
+                self._cond.wait(timeout=min(max(timeout, 0.01), 1.0))
+            # 라운드 로빈: 차례를 쓴 세션은 맨 뒤로 (대기열이 비면 제거)
+            queue = self._queues.pop(session_id)
+            queue.popleft()
+            if queue: self._queues[session_id] = queue
+            if self.rate: self._tokens -= 1
+            self._in_flight += 1
+            self.requests += 1
+            wait = time.monotonic() - enqueued
+            self._waits.append(wait)
+            self._publish()
+            self._cond.notify_all()
+        METRICS.record("scheduler_wait", wait)
+        try: yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._publish()
+                self._cond.notify_all()
+
+    def _backoff(self, attempt: int, e: Exception) -> bool:
+        """재시도할 오류면 기다린 뒤 True"""
+        if attempt >= self.max_retries or not is_retryable(e):
+            with self._cond: self.failures += 1
+            return False
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        with self._cond: self.retries += 1
+        logger.warning(f"Retry {attempt + 1}/{self.max_retries} in {delay:.1f}s: {e}")
+        time.sleep(delay)
+        return True
+
+    def call(self, session_id: str, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                with self.slot(session_id): return fn(*args, **kwargs)
+            except Exception as e:
+                if not self._backoff(attempt, e): raise
+            attempt += 1
+
+    def stream(self, session_id: str, fn, *args, **kwargs) -> Iterator:
+        """스트리밍 호출. 첫 조각이 오기 전의 오류만 재시도 (이미 내보낸 조각은 되돌릴 수 없음)"""
+        attempt = 0
+        while True:
+            yielded = False
+            try:
+                with self.slot(session_id):
+                    for piece in fn(*args, **kwargs):
+                        yielded = True
+                        yield piece
+                return
+            except Exception as e:
+                if yielded or not self._backoff(attempt, e): raise
+            attempt += 1
+
+    def _publish(self):
+        METRICS.set_gauge("scheduler_queue_depth", sum(len(q) for q in self._queues.values()))
+        METRICS.set_gauge("scheduler_in_flight", self._in_flight)
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                "queue_depth": sum(len(q) for q in self._queues.values()),
+                "waiting_sessions": len(self._queues),
+                "in_flight": self._in_flight,
+                "tokens": round(self._tokens, 2),
+                "requests": self.requests, "retries": self.retries, "failures": self.failures,
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0,
+            }
+
+SCHEDULER = RequestScheduler()
+
+# ==============================================================================
+# FACTORIES
+# ==============================================================================
+def _fake_options() -> dict:
+    return {
+        "latency": float(os.getenv("PHODONG_FAKE_LATENCY", "0")),
+        "jitter": float(os.getenv("PHODONG_FAKE_JITTER", "0")),
+        "failure_rate": float(os.getenv("PHODONG_FAKE_FAILURE_RATE", "0")),
+    }
+
+def create_llm_backend(api_key=None, name: Optional[str] = None) -> LLMBackend:
+    init_runtime()
+    name = name or BACKEND_NAME
+    if name == "fake": return FakeLLMBackend(**_fake_options())
+    return GeminiBackend(api_key)
+
+_shared_backends: Dict[Tuple[str, Optional[str]], LLMBackend] = {}
+_shared_lock = threading.Lock()
+
+def get_llm_backend(api_key=None, name: Optional[str] = None) -> LLMBackend:
+    """프로세스 전체에서 재사용하는 LLM 백엔드 (configure/모델 생성은 키마다 한 번만)"""
+    init_runtime()
+    name = name or BACKEND_NAME
+    key = (name, api_key or os.getenv("GOOGLE_API_KEY"))
+    with _shared_lock:
+        if key not in _shared_backends: _shared_backends[key] = create_llm_backend(api_key, name)
+        return _shared_backends[key]
+
+def create_tts_backend(name: Optional[str] = None) -> TTSBackend:
+    init_runtime()
+    name = name or BACKEND_NAME
+    if name == "fake": return FakeTTSBackend(**_fake_options())
+    return GTTSBackend()
@@ -0,0 +1,314 @@
+import os
+import io
+import re
+import html
+import zlib
+import base64
+import logging
+import zipfile
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, List, Dict, Callable
+
+from PIL import Image
+
+from phodong_upload import StoryCard, FinalStory, ImageAsset
+from phodong_metrics import METRICS
+
+logger = logging.getLogger("PhodongCore")
+
+# 상수
+EXPORT_FORMATS = {
+    "html": {"label": "웹페이지 (HTML)", "mime": "text/html", "ext": "html"},
+    "zip": {"label": "압축 파일 (ZIP)", "mime": "application/zip", "ext": "zip"},
+    "pdf": {"label": "PDF", "mime": "application/pdf", "ext": "pdf"},
+}
+EXPORT_SPOOL_BYTES = int(os.getenv("PHODONG_EXPORT_SPOOL_BYTES", str(4 * 1024 * 1024)))   # 넘으면 임시 파일로 넘김 (작업 테이블에 TTL 동안 남으므로 작게)
+B64_CHUNK = 3 * 16 * 1024                   # base64 스트리밍 조각 크기 (3의 배수라 중간에 패딩이 생기지 않음)
+PDF_PAGE = (595, 842)                       # A4 (pt)
+PDF_MARGIN = 50
+PDF_FONT = "HYGoThic-Medium"                # Acrobat 등이 제공하는 Adobe-Korea1 기본 글꼴 (임베드하지 않음)
+PDF_ENCODING = "UniKS-UTF16-H"              # 대부분의 뷰어(Acrobat, pdf.js, MuPDF)에 내장된 CMap
+
+@dataclass
+class Storybook:
+    """내보낼 동화책 (세션에 이미 있는 인코딩된 JPEG/base64와 MP3를 그대로 참조)"""
+    story: FinalStory
+    cards: List[StoryCard]
+    images: Dict[str, ImageAsset] = field(default_factory=dict)
+    audio: Optional[bytes] = None
+
+    def scenes(self):
+        """(장면 번호, 카드, 이미지 또는 None)"""
+        for i, card in enumerate(self.cards, start=1):
+            yield i, card, self.images.get(card.image_key)
+
+    def file_name(self, fmt: str) -> str:
+        stem = re.sub(r'[\\/:*?"<>|\s]+', "_", self.story.title).strip("_")[:40] or "phodong"
+        return f"{stem}.{EXPORT_FORMATS[fmt]['ext']}"
+
+def _write_b64(fp, data: bytes):
+    """큰 바이트열을 조각 단위로 base64 인코딩해 텍스트 스트림에 씀"""
+    view = memoryview(data)
+    for i in range(0, len(view), B64_CHUNK):
+        fp.write(base64.b64encode(view[i:i + B64_CHUNK]).decode("ascii"))
+
+class _Utf8Writer:
+    """write(str)를 UTF-8로 바꿔 바이너리 스트림에 넘김 (write_html이 임시 파일/ZIP 항목에 바로 쓰도록)"""
+    def __init__(self, raw): self.raw = raw
+    def write(self, s: str): self.raw.write(s.encode("utf-8"))
+
+class StorybookExporter:
+    """동화책을 HTML / ZIP / PDF로 스트리밍 기록 (문서를 메모리에서 한 번에 조립하지 않음)"""
+
+    CSS = """
+        body { margin: 0; background: #FFFBF8; font-family: 'Gowun Dodum', 'Apple SD Gothic Neo', 'Malgun Gothic', sans-serif; color: #555; }
+        main { max-width: 860px; margin: 0 auto; padding: 40px 20px; }
+        h1, h2 { font-family: 'Jua', sans-serif; color: #FF9EAA; text-align: center; }
+        .book { background: white; padding: 40px; border-radius: 15px; box-shadow: 0 10px 40px rgba(0,0,0,0.08); border-left: 10px solid #FF9EAA; }
+        .story { font-size: 1.15rem; line-height: 2.0; white-space: pre-wrap; text-align: justify; }
+        .scene { display: flex; gap: 24px; align-items: flex-start; margin: 40px 0; flex-wrap: wrap; }
+        .polaroid { background: white; padding: 15px 15px 40px; border: 1px solid #EEE; box-shadow: 0 8px 20px rgba(0,0,0,0.05); flex: 1 1 320px; }
+        .polaroid img { width: 100%; display: block; }
+        .polaroid p { text-align: center; color: #BBB; margin-top: 15px; }
+        .card { flex: 1 1 320px; }
+        .dialogue { background: #FFFBE6; border: 2px solid #FFF5C4; border-radius: 20px 20px 20px 0; padding: 20px; font-size: 1.2rem; color: #5D4037; }
+        audio { width: 100%; margin: 20px 0; }
+    """
+
+    @staticmethod
+    def write_html(fp, book: Storybook, media: Optional[Dict[str, str]] = None,
+                   on_progress: Optional[Callable[[int], None]] = None):
+        """텍스트 스트림에 HTML을 씀
+
+        media: {image_key 또는 "audio": 상대 경로} - 주어지면 파일을 링크하고, 없으면 data URI로 인라인
+        (이미지는 AssetStore가 이미 만들어 둔 base64를 그대로 씀)
+        """
+        esc = html.escape
+        fp.write(f"<!DOCTYPE html>\n<html lang='ko'><head><meta charset='utf-8'>"
+                 f"<meta name='viewport' content='width=device-width, initial-scale=1'>"
+                 f"<title>{esc(book.story.title)}</title><style>{StorybookExporter.CSS}</style></head><body><main>\n")
+        fp.write(f"<h1>{esc(book.story.title)}</h1>\n")
+        if book.audio:
+            if media and "audio" in media: fp.write(f"<audio controls src='{esc(media['audio'])}'></audio>\n")
+            else:
+                fp.write("<audio controls src='data:audio/mpeg;base64,")
+                _write_b64(fp, book.audio)
+                fp.write("'></audio>\n")
+        fp.write(f"<div class='book'><div class='story'>{esc(book.story.story)}</div></div>\n")
+
+        for i, card, asset in book.scenes():
+            fp.write(f"<h2>Scene {i}</h2>\n<section class='scene'><div class='polaroid'>")
+            if media and card.image_key in media: fp.write(f"<img src='{esc(media[card.image_key])}' alt='{esc(card.character_name)}'>")
+            elif asset:
+                fp.write("<img src='data:image/jpeg;base64,")
+                fp.write(asset.b64)
+                fp.write(f"' alt='{esc(card.character_name)}'>")
+            fp.write(f"<p>{esc(card.character_name)}</p></div>")
+            fp.write(f"<div class='card'><div class='dialogue'>\"{esc(card.dialogue)}\"</div>"
+                     f"<p>상황: {esc(card.story_narration)}</p>"
+                     f"<p><small>{esc(card.character_type)} · {esc(card.personality)} · {esc(card.magic_power)}</small></p></div></section>\n")
+            if on_progress: on_progress(i)
+        fp.write(f"<p style='text-align:center; color:#BBB;'>🧸 포동 PHODONG · {datetime.now():%Y-%m-%d}</p>\n</main></body></html>\n")
+
+    @staticmethod
+    def write_zip(fp, book: Storybook, on_progress: Optional[Callable[[int], None]] = None):
+        """이미 압축된 JPEG/MP3는 그대로 저장(ZIP_STORED)하고, index.html이 이 파일들을 링크함"""
+        media = {card.image_key: f"images/scene_{i:02d}.jpg" for i, card, asset in book.scenes() if asset}
+        if book.audio: media["audio"] = "story.mp3"
+        with zipfile.ZipFile(fp, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("story.txt", book.story.text)
+            if book.audio: zf.writestr(media["audio"], book.audio, compress_type=zipfile.ZIP_STORED)
+            for i, card, asset in book.scenes():
+                if asset: zf.writestr(media[card.image_key], asset.jpeg, compress_type=zipfile.ZIP_STORED)
+                if on_progress: on_progress(i)
+            with zf.open("index.html", "w") as raw:
+                StorybookExporter.write_html(_Utf8Writer(raw), book, media=media)
+
+    @staticmethod
+    def write_pdf(fp, book: Storybook, on_progress: Optional[Callable[[int], None]] = None):
+        """표지 → 본문 → 장면(사진 + 카드) 순서의 PDF. JPEG는 DCTDecode로 다시 인코딩 없이 넣고 MP3는 첨부 파일로 넣음"""
+        _PdfWriter(fp).write_book(book, on_progress)
+
+    @staticmethod
+    def export(book: Storybook, fmt: str, on_progress: Optional[Callable[[int], None]] = None) -> tempfile.SpooledTemporaryFile:
+        """형식에 맞게 기록한 파일 (EXPORT_SPOOL_BYTES까지는 메모리, 넘으면 임시 파일). 읽기 위치는 처음"""
+        if fmt not in EXPORT_FORMATS: raise ValueError(f"unknown export format: {fmt}")
+        out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, suffix=f".{EXPORT_FORMATS[fmt]['ext']}")
+        with METRICS.span(f"export_{fmt}", images=sum(1 for _, _, a in book.scenes() if a)) as span:
+            if fmt == "html": StorybookExporter.write_html(_Utf8Writer(out), book, on_progress=on_progress)
+            elif fmt == "zip": StorybookExporter.write_zip(out, book, on_progress)
+            else: StorybookExporter.write_pdf(out, book, on_progress)
+            span["bytes_out"] = out.tell()
+        logger.info(f"Export [{fmt}]: {span['bytes_out']} bytes, {len(book.cards)} scenes")
+        out.seek(0)
+        return out
+
+# ==============================================================================
+# PDF
+# ==============================================================================
+def _pdf_str(text: str) -> str:
+    """PDF 문자열 리터럴 (괄호/역슬래시 이스케이프, ASCII 전용)"""
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+class _PdfWriter:
+    """객체를 만드는 즉시 스트림에 쓰고 오프셋만 기억하는 최소 PDF 작성기"""
+    W, H = PDF_PAGE
+    LINE = 1.7                              # 줄 간격 (글자 크기 배수)
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.pos = 0
+        self.offsets: Dict[int, int] = {}
+        self.next_id = 1
+        self.pages: List[int] = []
+
+    def _write(self, data: bytes):
+        self.fp.write(data)
+        self.pos += len(data)
+
+    def alloc(self) -> int:
+        self.next_id += 1
+        return self.next_id - 1
+
+    def obj(self, oid: int, body: str):
+        self.offsets[oid] = self.pos
+        self._write(f"{oid} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+
+    def stream(self, oid: int, attrs: str, data: bytes):
+        self.offsets[oid] = self.pos
+        self._write(f"{oid} 0 obj\n<< {attrs} /Length {len(data)} >>\nstream\n".encode("latin-1"))
+        self._write(data)
+        self._write(b"\nendstream\nendobj\n")
+
+    # ---- 글자 ----
+    @staticmethod
+    def _text(s: str) -> str:
+        """UTF-16BE 16진 문자열 (BMP 밖의 문자(이모지 등)는 글꼴에 없으므로 뺌)"""
+        return "<" + "".join(f"{ord(c):04X}" for c in s if ord(c) <= 0xFFFF) + ">"
+
+    @staticmethod
+    def _width(s: str, size: float) -> float:
+        return sum(size * (0.5 if ord(c) < 0x80 else 1.0) for c in s)
+
+    @classmethod
+    def wrap(cls, text: str, size: float, width: float) -> List[str]:
+        """띄어쓰기 단위 줄바꿈 (한 단어가 줄보다 길면 글자 단위로 자름)"""
+        lines = []
+        for para in text.splitlines() or [""]:
+            line = ""
+            for word in para.split(" "):
+                candidate = f"{line} {word}" if line else word
+                if cls._width(candidate, size) <= width:
+                    line = candidate
+                    continue
+                if line: lines.append(line)
+                line = ""
+                for ch in word:
+                    if cls._width(line + ch, size) > width:
+                        lines.append(line)
+                        line = ""
+                    line += ch
+            lines.append(line)
+        return lines
+
+    def _draw_lines(self, ops: list, lines: List[str], size: float, y: float, color: str = "0.33 0.33 0.33", center: bool = False) -> float:
+        ops.append(f"{color} rg")
+        for line in lines:
+            x = (self.W - self._width(line, size)) / 2 if center else PDF_MARGIN
+            ops.append(f"BT /F1 {size} Tf {x:.1f} {y:.1f} Td {self._text(line)} Tj ET")
+            y -= size * self.LINE
+        return y
+
+    # ---- 페이지 ----
+    def page(self, ops: list, images: Optional[Dict[str, int]] = None):
+        content, page = self.alloc(), self.alloc()
+        self.stream(content, "/Filter /FlateDecode", zlib.compress("\n".join(ops).encode("latin-1")))
+        xobjects = " ".join(f"/{name} {oid} 0 R" for name, oid in (images or {}).items())
+        self.obj(page, f"<< /Type /Page /Parent {self.pages_id} 0 R /MediaBox [0 0 {self.W} {self.H}] "
+                       f"/Resources << /Font << /F1 {self.font_id} 0 R >> /XObject << {xobjects} >> >> /Contents {content} 0 R >>")
+        self.pages.append(page)
+
+    def text_pages(self, lines: List[str], size: float, top: Optional[float] = None, ops: Optional[list] = None):
+        """줄 목록을 필요한 만큼 페이지를 넘기며 그림"""
+        ops = ops if ops is not None else []
+        y = top if top is not None else self.H - PDF_MARGIN
+        for line in lines:
+            if y < PDF_MARGIN:
+                self.page(ops)
+                ops, y = [], self.H - PDF_MARGIN
+            y = self._draw_lines(ops, [line], size, y)
+        if ops: self.page(ops)
+
+    def image(self, jpeg: bytes) -> tuple:
+        """JPEG 바이트를 그대로 이미지 객체로 씀 (헤더만 읽어 크기/색공간 확인). (객체 id, 폭, 높이)"""
+        with Image.open(io.BytesIO(jpeg)) as img: (w, h), mode = img.size, img.mode
+        colorspace = {"L": "/DeviceGray", "CMYK": "/DeviceCMYK"}.get(mode, "/DeviceRGB")
+        oid = self.alloc()
+        self.stream(oid, f"/Type /XObject /Subtype /Image /Width {w} /Height {h} /ColorSpace {colorspace} "
+                         f"/BitsPerComponent 8 /Filter /DCTDecode", jpeg)
+        return oid, w, h
+
+    def write_book(self, book: Storybook, on_progress: Optional[Callable[[int], None]] = None):
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        catalog, self.pages_id, self.font_id = self.alloc(), self.alloc(), self.alloc()
+        cid_font, descriptor = self.alloc(), self.alloc()
+        self.obj(self.font_id, f"<< /Type /Font /Subtype /Type0 /BaseFont /{PDF_FONT}-{PDF_ENCODING} /Encoding /{PDF_ENCODING} "
+                               f"/DescendantFonts [{cid_font} 0 R] >>")
+        # 라틴(CID 1~100)은 폭 500으로 어림하고 나머지는 전각 1000 (줄바꿈 계산과 같은 기준)
+        self.obj(cid_font, f"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /{PDF_FONT} "
+                           f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Korea1) /Supplement 1 >> "
+                           f"/FontDescriptor {descriptor} 0 R /DW 1000 /W [1 100 500] >>")
+        self.obj(descriptor, f"<< /Type /FontDescriptor /FontName /{PDF_FONT} /Flags 6 /FontBBox [-6 -145 1003 880] "
+                             f"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 59 >>")
+        width = self.W - 2 * PDF_MARGIN
+
+        # 표지
+        ops = []
+        y = self._draw_lines(ops, self.wrap(book.story.title, 28, width), 28, self.H * 0.6, color="1 0.62 0.67", center=True)
+        self._draw_lines(ops, [f"포동 PHODONG · {datetime.now():%Y-%m-%d}"], 12, y - 20, color="0.73 0.73 0.73", center=True)
+        self.page(ops)
+
+        # 본문
+        ops = []
+        y = self._draw_lines(ops, self.wrap(book.story.title, 18, width), 18, self.H - PDF_MARGIN - 18, color="1 0.62 0.67")
+        self.text_pages(self.wrap(book.story.story, 12, width), 12, top=y - 12, ops=ops)
+
+        # 장면
+        for i, card, asset in book.scenes():
+            ops, images = [], {}
+            y = self._draw_lines(ops, [f"Scene {i} · {card.character_name}"], 16, self.H - PDF_MARGIN - 16, color="1 0.62 0.67") - 4
+            if asset:
+                oid, w, h = self.image(asset.jpeg)
+                scale = min(width / w, (self.H * 0.5) / h)
+                dw, dh = w * scale, h * scale
+                y -= dh
+                ops.append(f"q {dw:.1f} 0 0 {dh:.1f} {(self.W - dw) / 2:.1f} {y:.1f} cm /Im{i} Do Q")
+                images[f"Im{i}"] = oid
+                y -= 28
+            lines = self.wrap(f"\"{card.dialogue}\"", 12, width) + [""] + self.wrap(f"상황: {card.story_narration}", 12, width)
+            # 사진 아래에 다 들어가지 않으면 이어지는 페이지로 넘김
+            fit = max(0, int((y - PDF_MARGIN) // (12 * self.LINE)) + 1)
+            y = self._draw_lines(ops, lines[:fit], 12, y)
+            self.page(ops, images)
+            if lines[fit:]: self.text_pages(lines[fit:], 12)
+            if on_progress: on_progress(i)
+
+        # MP3는 첨부 파일로 (대부분의 뷰어에서 첨부 목록으로 열 수 있음)
+        names = ""
+        if book.audio:
+            audio, spec = self.alloc(), self.alloc()
+            self.stream(audio, "/Type /EmbeddedFile /Subtype /audio#2Fmpeg", book.audio)
+            self.obj(spec, f"<< /Type /Filespec /F (story.mp3) /UF (story.mp3) /EF << /F {audio} 0 R >> /Desc {_pdf_str('Story narration')} >>")
+            names = f" /Names << /EmbeddedFiles << /Names [(story.mp3) {spec} 0 R] >> >> /PageMode /UseAttachments"
+
+        kids = " ".join(f"{p} 0 R" for p in self.pages)
+        self.obj(self.pages_id, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>")
+        self.obj(catalog, f"<< /Type /Catalog /Pages {self.pages_id} 0 R{names} >>")
+
+        xref = self.pos
+        rows = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        rows += [f"{self.offsets[oid]:010d} 00000 n \n" for oid in range(1, self.next_id)]
+        self._write("".join(rows).encode("latin-1"))
+        self._write(f"trailer\n<< /Size {self.next_id} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
@@ -0,0 +1,156 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, Callable
+
+from phodong_upload import (
+    StoryConfig, LLMService, AudioService, ImagePipeline,
+    DEFAULT_ENGINE, DEFAULT_CONCURRENCY
+)
+from phodong_metrics import METRICS, RunTrace
+from phodong_export import Storybook, StorybookExporter, EXPORT_FORMATS
+
+logger = logging.getLogger("PhodongCore")
+
+# 상수
+JOB_WORKERS = int(os.getenv("PHODONG_JOB_WORKERS", "8"))   # 동시에 돌아가는 생성 작업 수 (세션 수와 무관)
+JOB_TTL_SEC = int(os.getenv("PHODONG_JOB_TTL", "3600"))    # 끝난 작업 결과를 보관하는 시간
+
+@dataclass
+class Job:
+    """스크립트 실행과 분리되어 돌아가는 생성 작업 (새로고침 후에도 id로 다시 붙을 수 있음)"""
+    kind: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    status: str = "pending"                     # pending | running | done | error
+    total: int = 0
+    done: int = 0
+    partial: Dict[int, Any] = field(default_factory=dict)   # 사진 번호별 중간 결과 (카드)
+    text: str = ""                              # 스트리밍 중인 텍스트 (최종 동화)
+    result: Any = None
+    error: Optional[str] = None
+    meta: Dict[str, Any] = field(default_factory=dict)
+    trace: Optional[RunTrace] = None
+    created: float = field(default_factory=time.time)
+    updated: float = field(default_factory=time.time)
+    future: Optional[Future] = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def finished(self) -> bool: return self.status in ("done", "error")
+
+    @property
+    def progress(self) -> float: return self.done / self.total if self.total else 0.0
+
+    def update(self, **kwargs):
+        with self._lock:
+            for k, v in kwargs.items(): setattr(self, k, v)
+            self.updated = time.time()
+
+    def put_partial(self, index: int, value):
+        with self._lock:
+            self.partial[index] = value
+            self.updated = time.time()
+
+    def append_text(self, piece: str):
+        with self._lock:
+            self.text += piece
+            self.updated = time.time()
+
+class JobManager:
+    """프로세스 단위 작업 테이블 + 작업자 실행기 (끝난 작업은 TTL이 지나면 제거)"""
+
+    def __init__(self, workers: int = JOB_WORKERS, ttl: float = JOB_TTL_SEC):
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="phodong-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[[Job], Any], total: int = 0, **meta) -> Job:
+        job = Job(kind=kind, total=total, meta=meta)
+        with self._lock:
+            self._evict()
+            self._jobs[job.job_id] = job
+        job.future = self._pool.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn):
+        job.update(status="running")
+        try: job.update(result=fn(job), status="done")
+        except Exception as e:
+            logger.error(f"Job Error [{job.kind} {job.job_id}]: {e}")
+            job.update(error=str(e), status="error")
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        if not job_id: return None
+        with self._lock:
+            self._evict()
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {"jobs": len(jobs), "running": sum(j.status == "running" for j in jobs),
+                "pending": sum(j.status == "pending" for j in jobs)}
+
+    def _evict(self):
+        now = time.time()
+        for job_id in [j.job_id for j in self._jobs.values() if j.finished and now - j.updated > self.ttl]:
+            del self._jobs[job_id]
+
+JOBS = JobManager()
+
+# ==============================================================================
+# GENERATION JOBS
+# ==============================================================================
+def run_cards_job(job: Job, llm: LLMService, sources: list, config: StoryConfig,
+                  use_cache: bool = True, prefetched: Optional[dict] = None) -> dict:
+    """사진 전처리 + 카드 생성. 결과: {"cards": [...], "images": {image_key: 표시용 JPEG}, "summary": {...}}"""
+    with METRICS.run("cards") as trace:
+        job.update(trace=trace)
+        images = [ImagePipeline.load(src) for src in sources]
+        cards = llm.generate_cards(
+            images, config, engine=DEFAULT_ENGINE, concurrency=DEFAULT_CONCURRENCY,
+            on_progress=lambda done, total: job.update(done=done, total=total),
+            on_result=job.put_partial, use_cache=use_cache, prefetched=prefetched
+        )
+
+    result = {"cards": [], "images": {}, "summary": llm.last_summary}
+    for i, (card, img) in enumerate(zip(cards, images)):
+        if card:
+            card.image_key = f"img_{i}_{job.job_id}"
+            result["cards"].append(card)
+            result["images"][card.image_key] = img.display_jpeg
+    return result
+
+def run_final_job(job: Job, llm: LLMService, cards: list, config: StoryConfig) -> dict:
+    """최종 동화 스트리밍 (JSON 조각이 job.text에 쌓임) + 완성 후 TTS. 결과: {"story": FinalStory, "audio": ...}"""
+    with METRICS.run("final") as trace:
+        job.update(trace=trace)
+        complete = True
+        try:
+            for chunk in llm.generate_final_story_stream(cards, config):
+                job.append_text(chunk)
+        except Exception:
+            # 중간에 끊긴 본문은 화면에서 지우고 전체를 다시 생성 (잘린 JSON을 고치기로 메우지 않음)
+            complete = False
+            job.update(text="")
+        # 다 모인 응답을 여기서 한 번만 파싱 (화면은 재실행마다 다시 파싱하지 않음)
+        story = llm.parse_final_story(job.text, cards, config, complete=complete)
+        # TTS는 본문이 모두 도착한 뒤에 시작
+        job.update(meta={**job.meta, "stage": "tts"})
+        audio = AudioService.create(story.text)
+    return {"story": story, "audio": audio}
+
+def run_export_job(job: Job, book: Storybook, fmt: str) -> dict:
+    """동화책 파일 기록 (장면마다 진행률 갱신). 결과: {"file": 읽기 위치가 처음인 임시 파일, "name", "mime", "size"}"""
+    with METRICS.run("export") as trace:
+        job.update(trace=trace)
+        out = StorybookExporter.export(book, fmt, on_progress=lambda i: job.update(done=i))
+    out.seek(0, os.SEEK_END)
+    size = out.tell()
+    out.seek(0)
+    return {"file": out, "name": book.file_name(fmt), "mime": EXPORT_FORMATS[fmt]["mime"], "size": size}
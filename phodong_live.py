@@ -1,6 +1,8 @@
+import hashlib
 import streamlit as st
-import time
-import io
+from dataclasses import asdict
+
+from phodong_upload import ImagePipeline
 
 class CameraManager:
     """카메라 촬영 및 캡처된 이미지 관리를 담당하는 클래스"""
@@ -9,10 +11,31 @@ class CameraManager:
     def init_state():
         if "camera_captures" not in st.session_state:
             st.session_state.camera_captures = []
+        if "camera_digests" not in st.session_state:
+            st.session_state.camera_digests = set()   # 한 번이라도 받은 사진 (비운 뒤 같은 프레임이 다시 들어오지 않도록 유지)
+        if "camera_jobs" not in st.session_state:
+            st.session_state.camera_jobs = {}         # {digest: (설정 스냅샷, 카드 생성 Future)}
+
+    @staticmethod
+    def clear():
+        """모은 사진을 비우고, 아직 시작 전인 미리 생성 작업은 취소 (진행 중인 작업의 결과는 버림)"""
+        for _, fut in st.session_state.camera_jobs.values(): fut.cancel()
+        st.session_state.camera_jobs = {}
+        st.session_state.camera_captures = []
 
     @staticmethod
-    def render_camera_ui():
-        """카메라 UI를 그리고, 최종적으로 선택된 이미지 리스트(BytesIO)를 반환하거나 None을 반환"""
+    def prefetched_jobs(config) -> dict:
+        """현재 설정과 같은 설정으로 시작된 미리 생성 작업만 {digest: Future}로 반환"""
+        current = asdict(config)
+        return {d: fut for d, (snapshot, fut) in st.session_state.camera_jobs.items()
+                if snapshot == current and not fut.cancelled()}
+
+    @staticmethod
+    def render_camera_ui(speculate=None):
+        """카메라 UI를 그리고, 최종적으로 선택된 이미지 리스트(PreparedImage)를 반환하거나 None을 반환
+
+        speculate: 촬영 직후 호출되어 (설정 스냅샷 dict, Future)를 돌려주는 함수 - 카드 생성을 미리 시작
+        """
         CameraManager.init_state()
         
         st.markdown("### 📸 실시간 촬영 모드")
@@ -26,11 +49,20 @@ class CameraManager:
             
             if cam_image:
                 bytes_data = cam_image.getvalue()
-                # 중복 방지 (가장 최근 사진과 비교)
-                if not st.session_state.camera_captures or st.session_state.camera_captures[-1] != bytes_data:
-                    st.session_state.camera_captures.append(bytes_data)
-                    st.toast(f"📸 찰칵! ({len(st.session_state.camera_captures)}장 저장됨)")
-                    time.sleep(0.5) 
+                # 중복 방지 (이미 받은 사진의 digest 집합과 비교)
+                digest = hashlib.sha256(bytes_data).hexdigest()
+                if digest not in st.session_state.camera_digests:
+                    st.session_state.camera_digests.add(digest)
+                    # 촬영 시점에 한 번만 디코딩 (갤러리/LLM 모두 이 결과를 재사용)
+                    img = ImagePipeline.prepare(bytes_data, digest)
+                    # 앞서 찍은 사진과 거의 같으면 (연사 등) 미리 생성하지 않음 - 만들 때 그 사진의 카드를 함께 씀
+                    twin = ImagePipeline.find_near_duplicate(img, st.session_state.camera_captures)
+                    st.session_state.camera_captures.append(img)
+                    if speculate and twin is None:
+                        job = speculate(img)
+                        if job: st.session_state.camera_jobs[digest] = job
+                    note = " - 비슷한 사진이라 이야기를 함께 써요" if twin else ""
+                    st.toast(f"📸 찰칵! ({len(st.session_state.camera_captures)}장 저장됨){note}")
                     st.rerun()
 
         # [오른쪽] 찍은 사진 갤러리 & 완료 버튼
@@ -40,10 +72,10 @@ class CameraManager:
             if st.session_state.camera_captures:
                 # 갤러리 뷰 (3열 그리드)
                 cols = st.columns(3)
-                for idx, img_bytes in enumerate(st.session_state.camera_captures):
+                for idx, img in enumerate(st.session_state.camera_captures):
                     with cols[idx % 3]:
                         # 이미지는 꽉 차게 보여주는 것이 좋으므로 use_container_width 사용
-                        st.image(img_bytes, use_container_width=True)
+                        st.image(img.display_jpeg, use_container_width=True)
                 
                 st.markdown("---")
                 
@@ -51,12 +83,12 @@ class CameraManager:
                 with col_act1:
                     # 버튼의 width 옵션 제거 (CSS가 처리함)
                     if st.button("🗑️ 비우기"):
-                        st.session_state.camera_captures = []
+                        CameraManager.clear()
                         st.rerun()
                 with col_act2:
                     # 버튼의 width 옵션 제거 (CSS가 처리함)
                     if st.button("✨ 이야기 만들기", type="primary"):
-                        return [io.BytesIO(b) for b in st.session_state.camera_captures]
+                        return list(st.session_state.camera_captures)
             else:
                 st.markdown("""
                 <div style="padding:20px; border:2px dashed #DDD; border-radius:10px; text-align:center; color:#AAA;">
@@ -64,4 +96,4 @@ class CameraManager:
                 </div>
                 """, unsafe_allow_html=True)
         
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict
+
+logger = logging.getLogger("PhodongMetrics")
+
+# 상수
+METRICS_FILE = os.getenv("PHODONG_METRICS_FILE")    # 지정하면 실행이 끝날 때마다 Prometheus 텍스트를 기록
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+SESSION_MEMORY_TTL_SEC = 3600                       # 갱신이 끊긴 세션의 메모리 기록 보관 시간
+SIZE_ATTRS = ["images", "bytes_in", "bytes_out", "prompt_chars", "response_chars", "prompt_tokens", "output_tokens", "cached_tokens", "calls_saved"]
+
+@dataclass
+class Span:
+    stage: str
+    seconds: float
+    attrs: dict = field(default_factory=dict)
+
+@dataclass
+class RunTrace:
+    """한 번의 생성 실행(카드 만들기 / 최종 동화)에서 기록된 단계별 구간"""
+    name: str
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    started: float = field(default_factory=time.time)
+    seconds: float = 0.0
+    spans: List[Span] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, span: Span):
+        with self._lock: self.spans.append(span)
+
+    def breakdown(self) -> List[dict]:
+        """단계별 합계 (디버그 패널용)"""
+        rows: Dict[str, dict] = {}
+        with self._lock: spans = list(self.spans)
+        for s in spans:
+            row = rows.setdefault(s.stage, {"stage": s.stage, "count": 0, "total_ms": 0.0})
+            row["count"] += 1
+            row["total_ms"] += s.seconds * 1000
+            for k in SIZE_ATTRS:
+                if k in s.attrs: row[k] = row.get(k, 0) + s.attrs[k]
+        for row in rows.values():
+            row["avg_ms"] = row["total_ms"] / row["count"]
+        return sorted(rows.values(), key=lambda r: -r["total_ms"])
+
+_current_trace: contextvars.ContextVar[Optional[RunTrace]] = contextvars.ContextVar("phodong_trace", default=None)
+
+class Metrics:
+    """단계별 시간/크기 계측 (구조화 로그 + Prometheus 텍스트 내보내기)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, dict] = {}
+        self._totals: Dict[str, int] = {}
+        self._sessions: Dict[str, dict] = {}
+        self._gauges: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str, **attrs):
+        """구간 기록. yield된 dict에 응답 크기 등 결과 값을 채워 넣을 수 있음"""
+        start = time.perf_counter()
+        try: yield attrs
+        except Exception:
+            attrs["error"] = True
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, **attrs)
+
+    def record(self, stage: str, seconds: float, **attrs):
+        with self._lock:
+            st_ = self._stages.setdefault(stage, {"count": 0, "sum": 0.0, "errors": 0, "buckets": [0] * len(LATENCY_BUCKETS)})
+            st_["count"] += 1
+            st_["sum"] += seconds
+            if attrs.get("error"): st_["errors"] += 1
+            for i, b in enumerate(LATENCY_BUCKETS):
+                if seconds <= b: st_["buckets"][i] += 1
+            for k in SIZE_ATTRS:
+                if k in attrs: self._totals[f"{stage}:{k}"] = self._totals.get(f"{stage}:{k}", 0) + int(attrs[k])
+
+        trace = _current_trace.get()
+        if trace: trace.add(Span(stage, seconds, dict(attrs)))
+        logger.info(json.dumps({"event": "span", "stage": stage, "ms": round(seconds * 1000, 2),
+                                "run": trace.run_id if trace else None, **attrs}, ensure_ascii=False))
+
+    @contextmanager
+    def run(self, name: str):
+        """실행 단위 추적 시작. 이 안에서 (그리고 copy_context로 넘긴 작업자에서) 기록된 구간이 모임"""
+        trace = RunTrace(name)
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try: yield trace
+        finally:
+            trace.seconds = time.perf_counter() - start
+            _current_trace.reset(token)
+            self.record(f"run_{name}", trace.seconds)
+            if METRICS_FILE: self.write(METRICS_FILE)
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock: self._gauges[name] = value
+
+    def set_session_memory(self, session_id: str, **stores: int):
+        """세션이 붙잡고 있는 메모리 (image_storage / camera_captures 등, 바이트)"""
+        with self._lock: self._sessions[session_id] = {"updated": time.time(), **stores}
+
+    def session_memory(self) -> Dict[str, dict]:
+        now = time.time()
+        with self._lock:
+            for sid in [s for s, v in self._sessions.items() if now - v["updated"] > SESSION_MEMORY_TTL_SEC]:
+                del self._sessions[sid]
+            return {sid: dict(v) for sid, v in self._sessions.items()}
+
+    def export_prometheus(self) -> str:
+        sessions = self.session_memory()
+        lines = [
+            "# HELP phodong_stage_seconds Time spent per pipeline stage.",
+            "# TYPE phodong_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, st_ in sorted(self._stages.items()):
+                for b, n in zip(LATENCY_BUCKETS, st_["buckets"]):
+                    lines.append(f'phodong_stage_seconds_bucket{{stage="{stage}",le="{b}"}} {n}')
+                lines.append(f'phodong_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {st_["count"]}')
+                lines.append(f'phodong_stage_seconds_sum{{stage="{stage}"}} {st_["sum"]:.6f}')
+                lines.append(f'phodong_stage_seconds_count{{stage="{stage}"}} {st_["count"]}')
+            lines += ["# HELP phodong_stage_errors_total Failed spans per stage.", "# TYPE phodong_stage_errors_total counter"]
+            for stage, st_ in sorted(self._stages.items()):
+                lines.append(f'phodong_stage_errors_total{{stage="{stage}"}} {st_["errors"]}')
+            lines += ["# HELP phodong_stage_size_total Sizes processed per stage (images, bytes, chars, tokens).", "# TYPE phodong_stage_size_total counter"]
+            for key, v in sorted(self._totals.items()):
+                stage, kind = key.split(":", 1)
+                lines.append(f'phodong_stage_size_total{{stage="{stage}",kind="{kind}"}} {v}')
+            for name, v in sorted(self._gauges.items()):
+                lines += [f"# TYPE phodong_{name} gauge", f"phodong_{name} {v}"]
+
+        stores = sorted({k for v in sessions.values() for k in v if k != "updated"})
+        lines += ["# HELP phodong_session_bytes Memory held by live sessions.", "# TYPE phodong_session_bytes gauge"]
+        for store in stores:
+            values = [v.get(store, 0) for v in sessions.values()]
+            lines.append(f'phodong_session_bytes{{store="{store}",agg="sum"}} {sum(values)}')
+            lines.append(f'phodong_session_bytes{{store="{store}",agg="max"}} {max(values)}')
+        lines += ["# TYPE phodong_sessions gauge", f"phodong_sessions {len(sessions)}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        try:
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fp: fp.write(self.export_prometheus())
+            os.replace(tmp, path)
+        except Exception as e: logger.warning(f"Metrics Write Error: {e}")
+
+def submit_traced(pool, fn, *args, **kwargs):
+    """현재 추적 컨텍스트를 유지한 채 작업자 풀에 제출"""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+METRICS = Metrics()
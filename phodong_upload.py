@@ -4,26 +4,58 @@ import io
 import re
 import logging
 import base64
-from dataclasses import dataclass
-from typing import Optional, List
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from dataclasses import dataclass, asdict, replace
+from typing import Optional, List, Dict, Callable, Iterator, Tuple
 from datetime import datetime
 
-import google.generativeai as genai
-from gtts import gTTS
-from PIL import Image
-from dotenv import load_dotenv
+from PIL import Image, ImageOps
 
-# .env 로드
-load_dotenv()
+from phodong_backends import LLMBackend, TTSBackend, RequestScheduler, SCHEDULER, get_llm_backend, create_tts_backend
+from phodong_metrics import METRICS, submit_traced
 
-# 로깅
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+# .env 로드와 로깅 설정은 첫 화면을 빠르게 띄우기 위해 백엔드를 처음 쓸 때 함 (phodong_backends.init_runtime)
 logger = logging.getLogger("PhodongCore")
 
 # 상수
-DEFAULT_MODEL = "gemini-2.0-flash"
+DEFAULT_CONCURRENCY = int(os.getenv("PHODONG_CONCURRENCY", "4"))  # 동시에 보내는 카드 생성 요청 수
+DEFAULT_BATCH_SIZE = int(os.getenv("PHODONG_BATCH_SIZE", "4"))  # batch 엔진에서 한 번에 보내는 사진 수
+DEFAULT_ENGINE = os.getenv("PHODONG_ENGINE", "concurrent")        # "concurrent" | "batch"
+ENGINE_OPTIONS = ["concurrent", "batch"]
+THUMBNAIL_SIZE = (320, 320)                 # 모델에 보내는 썸네일 크기
+DISPLAY_SIZE = (1024, 1024)                 # 화면 표시용 이미지 최대 크기
+DISPLAY_JPEG_QUALITY = 85
+ASSET_BUDGET_BYTES = 32 * 1024 * 1024      # 세션당 표시용 이미지 저장 한도
+ASSET_MIN_SIDE = 160                        # 한도에 맞추려고 줄일 때 이보다 작게는 줄이지 않음
+TTS_LANG = "ko"
+TTS_CHUNK_CHARS = 100                       # gTTS 한 요청의 최대 글자 수
+TTS_CONCURRENCY = 4
+TTS_CACHE_MAX_ITEMS = 512                   # 메모리에 보관할 음성 조각 수
+DEDUPE_DISTANCE = int(os.getenv("PHODONG_DEDUPE_DISTANCE", "5"))        # 거의 같은 사진으로 볼 dHash 해밍 거리 (음수면 끔)
+DEDUPE_MIN_DETAIL = float(os.getenv("PHODONG_DEDUPE_MIN_DETAIL", "2.0"))  # 9x8 밝기 격자의 평균 이웃 차이가 이보다 작으면 (밋밋한 사진) 묶지 않음
+DEDUPE_CONTINUATION = os.getenv("PHODONG_DEDUPE_CONTINUATION", "0") == "1"  # 묶인 사진에 '다음 장면' 카드를 따로 요청
+PREFIX_REUSE = os.getenv("PHODONG_PREFIX_REUSE", "1") == "1"       # 카드 지시문을 시스템 지시로 분리해 설정별로 재사용
+CACHE_MAX_ITEMS = 256                       # 메모리 캐시에 보관할 카드 수
+CACHE_DISK_MAX_BYTES = 50 * 1024 * 1024     # 디스크 캐시 최대 용량
+CACHE_TTL_SEC = 7 * 24 * 3600               # 디스크 캐시 유효 기간
+CACHE_DISK_LOW_WATER = 0.9                  # 용량을 넘어 정리할 때 이 비율까지 줄여 다음 정리까지 여유를 둠
 GENRE_OPTIONS = ["전래동화", "판타지", "히어로", "요정", "일상", "자동차", "공주/왕자", "추리", "우주", "로봇", "동물", "공룡"]
 PURPOSE_OPTIONS = ["안전", "예절&규칙", "문화", "어휘력", "세계&다양성", "사고력", "기초과학", "자신감"]
+FINAL_STORY_FAILED = "이야기 생성에 실패했어요"
+
+# 응답 스키마 (모델이 이 형식으로만 답하도록 요청에 함께 보냄)
+CARD_FIELDS = ["character_name", "character_type", "magic_power", "personality", "dialogue", "story_narration"]
+CARD_REQUIRED = ["character_name", "story_narration", "dialogue"]   # 비어 있으면 쓸 수 없는 응답으로 봄
+CARD_SCHEMA = {"type": "OBJECT", "properties": {k: {"type": "STRING"} for k in CARD_FIELDS}, "required": CARD_FIELDS}
+CARDS_SCHEMA = {"type": "ARRAY", "items": {"type": "OBJECT", "properties": {"index": {"type": "INTEGER"}, **CARD_SCHEMA["properties"]},
+                                           "required": ["index"] + CARD_FIELDS}}
+# 제목이 본문보다 먼저 스트리밍되도록 순서를 지정 (gemini-2.0은 지정이 없으면 속성을 알파벳 순으로 내보내 story가 먼저 옴)
+FINAL_STORY_SCHEMA = {"type": "OBJECT", "properties": {"title": {"type": "STRING"}, "story": {"type": "STRING"}}, "required": ["title", "story"],
+                      "propertyOrdering": ["title", "story"]}
 
 @dataclass
 class StoryConfig:
@@ -43,6 +75,217 @@ class StoryCard:
     dialogue: str = ""
     image_key: Optional[str] = None 
 
+    @classmethod
+    def from_dict(cls, data) -> "StoryCard":
+        """스키마 응답(dict)을 카드로 변환. 형식이 다르거나 필수 필드가 비어 있으면 ValueError"""
+        if not isinstance(data, dict): raise ValueError(f"card must be an object, got {type(data).__name__}")
+        missing = [k for k in CARD_REQUIRED if not str(data.get(k) or "").strip()]
+        if missing: raise ValueError(f"card is missing {missing}")
+        return cls(**{k: str(data[k]).strip() for k in CARD_FIELDS if str(data.get(k) or "").strip()})
+
+@dataclass
+class FinalStory:
+    title: str
+    story: str
+
+    @property
+    def text(self) -> str:
+        """낭독용 전체 텍스트 (제목 + 본문)"""
+        return f"{self.title}\n\n{self.story}"
+
+    @classmethod
+    def from_dict(cls, data) -> "FinalStory":
+        if not isinstance(data, dict): raise ValueError(f"final story must be an object, got {type(data).__name__}")
+        title, story = str(data.get("title") or "").strip(), str(data.get("story") or "").strip()
+        if not story: raise ValueError("final story is missing 'story'")
+        return cls(title=title or "우리들의 동화", story=story)
+
+    @classmethod
+    def from_partial(cls, text: str) -> "FinalStory":
+        """스트리밍 중인 (아직 닫히지 않은) JSON에서 지금까지 도착한 제목/본문만 꺼냄 (화면 표시용)"""
+        fields = {}
+        for key in ("title", "story"):
+            m = re.search(rf'"{key}"\s*:\s*"((?:[^"\\]|\\.)*)', text)
+            if not m: continue
+            # 조각 경계에서 잘린 이스케이프(\, \uXX)는 다음 조각이 올 때까지 버림
+            raw = re.sub(r"\\u[0-9a-fA-F]{0,3}$", "", m.group(1))
+            if (len(raw) - len(raw.rstrip("\\"))) % 2: raw = raw[:-1]
+            try: fields[key] = json.loads(f'"{raw}"')
+            except ValueError: fields[key] = raw
+        return cls(title=fields.get("title") or "...", story=fields.get("story", ""))
+
+    @classmethod
+    def failed(cls) -> "FinalStory":
+        return cls(title="포동이의 동화", story=FINAL_STORY_FAILED)
+
+@dataclass
+class PreparedImage:
+    """한 번만 디코딩해 만든 사진 파생물 (모델용 썸네일 + 표시용 JPEG)"""
+    thumbnail: Image.Image
+    display_jpeg: bytes
+    digest: str
+    phash: int = 0      # 썸네일의 dHash (64비트) - 거의 같은 사진 찾기용
+    detail: float = 0.0 # dHash 격자의 평균 밝기 차이 - 작으면 해시 비트가 잡음뿐이라 비교에 쓰지 않음
+
+class ImagePipeline:
+    """업로드/카메라/LLM 경로가 공유하는 단일 디코딩 전처리"""
+
+    @staticmethod
+    def prepare(data: bytes, digest: Optional[str] = None) -> PreparedImage:
+        with METRICS.span("decode", images=1, bytes_in=len(data)):
+            img = Image.open(io.BytesIO(data))
+            # JPEG는 DCT 단계에서 바로 축소 디코딩 (12MP 사진도 표시 해상도 근처만 풀어냄)
+            if img.format == "JPEG": img.draft("RGB", DISPLAY_SIZE)
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail(DISPLAY_SIZE, Image.LANCZOS)
+
+        with METRICS.span("encode_display", images=1) as span:
+            buffered = io.BytesIO()
+            img.save(buffered, format="JPEG", quality=DISPLAY_JPEG_QUALITY, optimize=True)
+            span["bytes_out"] = buffered.tell()
+
+        with METRICS.span("thumbnail", images=1):
+            thumb = img.copy()
+            thumb.thumbnail(THUMBNAIL_SIZE)
+            phash, detail = ImagePipeline.dhash(thumb), ImagePipeline.detail(thumb)
+        return PreparedImage(thumbnail=thumb, display_jpeg=buffered.getvalue(),
+                             digest=digest or hashlib.sha256(data).hexdigest(), phash=phash, detail=detail)
+
+    @staticmethod
+    def _hash_grid(img: Image.Image) -> list:
+        return list(img.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+
+    @staticmethod
+    def dhash(img: Image.Image) -> int:
+        """가로로 이웃한 픽셀 밝기 차이로 만든 64비트 지각 해시"""
+        px = ImagePipeline._hash_grid(img)
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+        return bits
+
+    @staticmethod
+    def detail(img: Image.Image) -> float:
+        """dHash와 같은 격자에서 이웃 픽셀 밝기 차이의 평균 (밋밋한 사진은 모두 0x0 근처로 해시되어 서로 묶여 버림)"""
+        px = ImagePipeline._hash_grid(img)
+        return sum(abs(px[row * 9 + col] - px[row * 9 + col + 1]) for row in range(8) for col in range(8)) / 64
+
+    @staticmethod
+    def near_duplicate(a: PreparedImage, b: PreparedImage, max_distance: int = DEDUPE_DISTANCE) -> bool:
+        """해밍 거리 max_distance 이하면 거의 같은 사진 (음수면 끔, 둘 중 하나라도 밋밋하면 아님)"""
+        if max_distance < 0 or min(a.detail, b.detail) < DEDUPE_MIN_DETAIL: return False
+        return bin(a.phash ^ b.phash).count("1") <= max_distance
+
+    @staticmethod
+    def find_near_duplicate(img: PreparedImage, candidates: List[PreparedImage],
+                            max_distance: int = DEDUPE_DISTANCE) -> Optional[PreparedImage]:
+        """candidates 중 img와 거의 같은 첫 사진 (없으면 None)"""
+        return next((c for c in candidates if ImagePipeline.near_duplicate(c, img, max_distance)), None)
+
+    @staticmethod
+    def group_near_duplicates(images: List[PreparedImage], max_distance: int = DEDUPE_DISTANCE, keep=()) -> List[int]:
+        """사진마다 대표 사진 번호를 반환 (near_duplicate면 같은 묶음)
+
+        keep: 묶지 않고 항상 스스로 대표가 되는 사진 digest 집합
+        """
+        leaders: List[int] = []
+        reps: List[int] = []
+        for i, img in enumerate(images):
+            leader = i
+            if img.digest not in keep:
+                leader = next((r for r in reps if ImagePipeline.near_duplicate(images[r], img, max_distance)), i)
+            if leader == i: reps.append(i)
+            leaders.append(leader)
+        return leaders
+
+    @staticmethod
+    def load(source) -> PreparedImage:
+        """PreparedImage / bytes / 파일 객체 어느 것이든 PreparedImage로 변환"""
+        if isinstance(source, PreparedImage): return source
+        if isinstance(source, (bytes, bytearray)): return ImagePipeline.prepare(bytes(source))
+        if hasattr(source, "seek"): source.seek(0)
+        return ImagePipeline.prepare(source.read())
+
+@dataclass
+class ImageAsset:
+    jpeg: bytes
+    b64: str
+
+    @property
+    def nbytes(self) -> int: return len(self.jpeg) + len(self.b64)
+
+class AssetStore:
+    """세션별 표시용 이미지 저장소 (생성 시 한 번 인코딩한 JPEG + base64를 보관)"""
+
+    def __init__(self, budget_bytes: int = ASSET_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._assets: "OrderedDict[str, ImageAsset]" = OrderedDict()
+        self.nbytes = 0
+
+    def put(self, key: str, jpeg: bytes, max_bytes: Optional[int] = None) -> ImageAsset:
+        """한도 안에 들어가도록 넣음 (자리가 모자라면 줄여서 다시 인코딩, 그래도 안 되면 ValueError)
+        이미 들어 있는 이미지는 지금 화면의 장면이 쓰고 있을 수 있으므로 내보내지 않음"""
+        self.pop(key)
+        room = self.budget_bytes - self.nbytes
+        if max_bytes is not None: room = min(room, max_bytes)
+        jpeg = self._fit(key, jpeg, room)
+        asset = ImageAsset(jpeg=jpeg, b64=base64.b64encode(jpeg).decode("ascii"))
+        self._assets[key] = asset
+        self.nbytes += asset.nbytes
+        return asset
+
+    def replace(self, images: Dict[str, bytes]) -> List[str]:
+        """새 이야기의 이미지로 통째로 교체 (이전 앨범은 버리고, 한도를 사진 수로 나눠 각 사진에 배분)
+        반환: 줄여도 한도에 들어가지 않아 넣지 못한 이미지 key"""
+        self.clear()
+        share = self.budget_bytes // max(len(images), 1)
+        dropped = []
+        for key, jpeg in images.items():
+            try: self.put(key, jpeg, max_bytes=share)
+            except ValueError as e:
+                logger.warning(f"Asset Budget: {e}")
+                dropped.append(key)
+        return dropped
+
+    def clear(self):
+        self._assets.clear()
+        self.nbytes = 0
+
+    @staticmethod
+    def _cost(jpeg_len: int) -> int:
+        """JPEG + base64 사본이 차지하는 바이트"""
+        return jpeg_len + 4 * ((jpeg_len + 2) // 3)
+
+    @staticmethod
+    def _fit(key: str, jpeg: bytes, room: int) -> bytes:
+        if AssetStore._cost(len(jpeg)) <= room: return jpeg
+        img = Image.open(io.BytesIO(jpeg)).convert("RGB")
+        while AssetStore._cost(len(jpeg)) > room:
+            w, h = int(img.width * 0.75), int(img.height * 0.75)
+            if min(w, h) < ASSET_MIN_SIDE: raise ValueError(f"asset budget exceeded: no room for {key}")
+            img = img.resize((w, h), Image.LANCZOS)
+            buffered = io.BytesIO()
+            img.save(buffered, format="JPEG", quality=DISPLAY_JPEG_QUALITY, optimize=True)
+            jpeg = buffered.getvalue()
+        logger.warning(f"Asset Budget: downscaled {key} to {img.width}x{img.height}")
+        return jpeg
+
+    def get(self, key: Optional[str]) -> Optional[ImageAsset]:
+        return self._assets.get(key) if key else None
+
+    def get_b64(self, key: Optional[str]) -> Optional[str]:
+        asset = self.get(key)
+        return asset.b64 if asset else None
+
+    def pop(self, key: str):
+        asset = self._assets.pop(key, None)
+        if asset: self.nbytes -= asset.nbytes
+
+    def __len__(self): return len(self._assets)
+
+    def __contains__(self, key): return key in self._assets
+
 class Utils:
     @staticmethod
     def clean_json_text(text):
@@ -51,35 +294,145 @@ class Utils:
         if text.startswith("```"): text = text[:text.rfind("```")]
         return text.strip()
 
+class StoryCardCache:
+    """썸네일 해시 + StoryConfig 기반 카드 캐시 (메모리 LRU + 선택적 디스크 계층)"""
+
+    def __init__(self, max_items: int = CACHE_MAX_ITEMS, disk_dir: Optional[str] = None,
+                 disk_max_bytes: int = CACHE_DISK_MAX_BYTES, ttl: float = CACHE_TTL_SEC):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl = ttl
+        self._mem: "OrderedDict[str, StoryCard]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = 0
+        self._disk_bytes: Optional[int] = None     # 디스크 캐시의 누적 크기 (처음 정리할 때 한 번 훑어서 셈)
+        self._disk_lock = threading.Lock()
+        if disk_dir: os.makedirs(disk_dir, exist_ok=True)
+
     @staticmethod
-    def get_image_base64(pil_image: Image.Image) -> Optional[str]:
-        if not pil_image: return None
+    def make_key(thumbnail: Image.Image, config: StoryConfig) -> str:
+        """정규화된 썸네일 픽셀 + 설정값의 다이제스트"""
+        h = hashlib.sha256()
+        h.update(f"{thumbnail.mode}:{thumbnail.size}".encode())
+        h.update(thumbnail.tobytes())
+        h.update(json.dumps(asdict(config), ensure_ascii=False, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[StoryCard]:
+        with self._lock:
+            card = self._mem.get(key)
+            if card is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return replace(card)
+        card = self._disk_get(key)
+        with self._lock:
+            if card is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._mem_put(key, card)
+        return replace(card)
+
+    def put(self, key: str, card: StoryCard):
+        card = replace(card, image_key=None)
+        with self._lock: self._mem_put(key, card)
+        self._disk_put(key, card)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "items": len(self._mem)}
+
+    def _mem_put(self, key, card):
+        self._mem[key] = card
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items: self._mem.popitem(last=False)
+
+    def _disk_path(self, key): return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key) -> Optional[StoryCard]:
+        if not self.disk_dir: return None
+        path = self._disk_path(key)
         try:
-            buffered = io.BytesIO()
-            pil_image.save(buffered, format="JPEG")
-            return base64.b64encode(buffered.getvalue()).decode("ascii")
-        except: return None
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as fp: return StoryCard(**json.load(fp))
+        except FileNotFoundError: return None
+        except Exception as e:
+            logger.warning(f"Cache Read Error: {e}")
+            return None
 
-class LLMService:
-    def __init__(self, api_key=None):
-        self.api_key = api_key if api_key else os.getenv("GOOGLE_API_KEY")
-        if not self.api_key: raise ValueError("API Key가 없습니다.")
-        genai.configure(api_key=self.api_key)
-
-        generation_config = genai.types.GenerationConfig(
-            temperature=1.0,
-            response_mime_type="application/json"
-        )
-        self.model = genai.GenerativeModel(DEFAULT_MODEL, generation_config=generation_config)
-
-    def generate_story_card(self, image_file, config: StoryConfig) -> StoryCard:
+    def _disk_put(self, key, card):
+        if not self.disk_dir: return
         try:
-            pil_image = Image.open(image_file)
-            resized_image = pil_image.copy()
-            resized_image.thumbnail((320, 320))
+            path = self._disk_path(key)
+            data = json.dumps(asdict(card), ensure_ascii=False).encode("utf-8")
+            tmp = path + f".{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as fp: fp.write(data)
+            try: old = os.path.getsize(path)
+            except FileNotFoundError: old = 0
+            os.replace(tmp, path)
+            with self._disk_lock:
+                # 디렉터리 전체를 훑는 정리는 처음 한 번과 누적 크기가 한도를 넘었을 때만 (쓰기마다 listdir/stat 하지 않음)
+                if self._disk_bytes is None: self._disk_evict()
+                else:
+                    self._disk_bytes += len(data) - old
+                    if self._disk_bytes > self.disk_max_bytes: self._disk_evict()
+        except Exception as e: logger.warning(f"Cache Write Error: {e}")
+
+    def _disk_evict(self):
+        """만료된 항목을 지우고, 용량을 넘으면 오래된 순서대로 CACHE_DISK_LOW_WATER까지 삭제 (_disk_lock 안에서 호출)"""
+        now, entries, total = time.time(), [], 0
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"): continue
+            path = os.path.join(self.disk_dir, name)
+            try: st_ = os.stat(path)
+            except FileNotFoundError: continue
+            if now - st_.st_mtime > self.ttl:
+                try: os.remove(path)
+                except FileNotFoundError: pass
+                continue
+            entries.append((st_.st_mtime, st_.st_size, path))
+            total += st_.st_size
+        if total > self.disk_max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.disk_max_bytes * CACHE_DISK_LOW_WATER: break
+                try: os.remove(path)
+                except FileNotFoundError: pass
+                total -= size
+        self._disk_bytes = total
+
+CARD_CACHE = StoryCardCache(disk_dir=os.getenv("PHODONG_CACHE_DIR"))
 
-            prompt = [
-                f"""
+_background_pool: Optional[ThreadPoolExecutor] = None
+_background_lock = threading.Lock()
+
+def background_pool() -> ThreadPoolExecutor:
+    """세션 사이에 공유하는 백그라운드 작업자 풀 (촬영 중 미리 생성 등)"""
+    global _background_pool
+    with _background_lock:
+        if _background_pool is None:
+            _background_pool = ThreadPoolExecutor(max_workers=DEFAULT_CONCURRENCY * 2, thread_name_prefix="phodong-bg")
+        return _background_pool
+
+class LLMService:
+    def __init__(self, api_key=None, backend: Optional[LLMBackend] = None, session_id: str = "default",
+                 scheduler: Optional[RequestScheduler] = None, prefix_reuse: bool = PREFIX_REUSE):
+        # backend를 지정하지 않으면 PHODONG_BACKEND 설정에 따른 프로세스 공유 백엔드 사용 (기본: Gemini)
+        self.backend = backend if backend else get_llm_backend(api_key)
+        # 모든 호출은 공유 스케줄러를 거침 (분당 요청 수 / 동시 호출 수 / 세션 간 공정 순서 / 재시도)
+        self.scheduler = scheduler if scheduler else SCHEDULER
+        self.session_id = session_id
+        self.prefix_reuse = prefix_reuse
+        self.last_summary: dict = {}
+        self._usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        self._usage_lock = threading.Lock()
+
+    @staticmethod
+    def _card_instructions(config: StoryConfig) -> str:
+        return f"""
                 당신은 {config.age if config.age else 5}세 아이를 위한 베스트셀러 동화 작가입니다.
                 사진 속 사물이나 풍경을 의인화하여 생동감 넘치는 캐릭터를 만들고, 
                 마치 실제 동화책의 한 페이지를 읽는 듯한 아름답고 구체적인 문장으로 이야기를 서술하세요.
@@ -106,44 +459,341 @@ class LLMService:
                     "dialogue": "캐릭터의 대사",
                     "story_narration": "동화책 서술형 상황 묘사 (길고 구체적으로)"
                 }}
-                """,
-                resized_image
-            ]
-            
-            safety = [{"category": c, "threshold": "BLOCK_NONE"} for c in ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]]
-            
-            response = self.model.generate_content(prompt, generation_config=genai.types.GenerationConfig(response_mime_type="application/json"), safety_settings=safety)
-            
-            if response.text:
-                data = json.loads(Utils.clean_json_text(response.text))
-                if isinstance(data, list):
-                    if len(data) > 0:
-                        data = data[0]
-                    else:
-                        data = {} # 빈 리스트가 올 경우 대비
-                return StoryCard(
-                    character_name=data.get("character_name", "친구"),
-                    character_type=data.get("character_type", "요정"),
-                    personality=data.get("personality", "밝음"),
-                    magic_power=data.get("magic_power", "꿈꾸기"),
-                    story_narration=data.get("story_narration", "새로운 친구를 만났어요."),
-                    dialogue=data.get("dialogue", "안녕! 우리 같이 놀자."),
-                    image_key=f"img_{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
-                )
+                """
+
+    def _card_request(self, config: StoryConfig, contents: list) -> Tuple[list, Optional[str]]:
+        """카드 요청을 (요청 내용, 시스템 지시)로 나눔
+
+        지시문은 StoryConfig에만 달려 있으므로 시스템 지시로 보내 백엔드가 설정별로 한 번만 올려두고,
+        요청에는 사진(과 묶음/장면 안내)만 실음. prefix_reuse가 꺼져 있으면 예전처럼 요청 앞에 붙임
+        (과금 토큰이 줄어드는 것은 CONTEXT_CACHE="explicit"로 캐시가 실제로 만들어졌을 때뿐)
+        """
+        instructions = self._card_instructions(config)
+        if self.prefix_reuse: return contents, instructions
+        return [instructions] + contents, None
+
+    def usage(self) -> dict:
+        """이 서비스로 보낸 호출의 누적 입력 토큰 (cached_tokens: 명시적 컨텍스트 캐시에서 읽어 할인된 토큰)"""
+        with self._usage_lock: return dict(self._usage)
+
+    @staticmethod
+    def _card_from_data(data: dict) -> StoryCard:
+        card = StoryCard.from_dict(data)
+        card.image_key = f"img_{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+        return card
+
+    @staticmethod
+    def _error_card() -> StoryCard:
+        return StoryCard(character_name="오류 요정", story_narration="잠시 연결이 불안정했어요.", dialogue="다시 시도해볼까?", image_key=f"err_{datetime.now().strftime('%Y%m%d%H%M%S%f')}")
+
+    def _generate_json(self, prompt, stage: str = "llm_card", schema: Optional[dict] = None, system: Optional[str] = None):
+        images = sum(1 for p in prompt if isinstance(p, Image.Image))
+        prompt_chars = sum(len(p) for p in prompt if isinstance(p, str))
+        with METRICS.span(stage, images=images, prompt_chars=prompt_chars) as span:
+            response = self.scheduler.call(self.session_id, self.backend.generate, prompt, response_mime_type="application/json",
+                                           response_schema=schema, system_instruction=system)
+            span.update(response_chars=len(response.text or ""), prompt_tokens=response.prompt_tokens,
+                        output_tokens=response.output_tokens, cached_tokens=response.cached_tokens)
+        with self._usage_lock:
+            self._usage["calls"] += 1
+            self._usage["prompt_tokens"] += response.prompt_tokens
+            self._usage["cached_tokens"] += response.cached_tokens
+        return response
+
+    @staticmethod
+    def _parse_json(text: str):
+        with METRICS.span("json_clean", response_chars=len(text)):
+            return json.loads(Utils.clean_json_text(text))
+
+    @staticmethod
+    def _repair_prompt(text: str, schema: dict, error: Exception) -> str:
+        return f"""
+                아래 응답은 JSON 스키마에 맞지 않아 읽을 수 없습니다. (오류: {error})
+                내용은 최대한 그대로 살리고, 빠진 필드는 내용에 어울리게 채워서 스키마에 맞는 JSON으로만 다시 답하세요.
+
+                [스키마]
+                {json.dumps(schema, ensure_ascii=False)}
+
+                [응답]
+                {text}
+                """
+
+    def _parse_typed(self, text: str, prompt, schema: dict, parse: Callable, stage: str, retry: bool = True,
+                     system: Optional[str] = None):
+        """응답을 한 번만 파싱해 타입이 있는 결과로 반환
+
+        깨진 응답이면 (1) 깨진 텍스트만 보내 스키마에 맞게 고치는 가벼운 호출, (2) 원래 요청 한 번 더
+        순서로 시도하고, 그래도 안 되면 ValueError (JSON 오류도 ValueError)
+        """
+        try: return parse(self._parse_json(text or ""))
+        except ValueError as e: error = e
+        logger.warning(f"Malformed Response [{stage}]: {error}")
+        if text and text.strip():
+            try:
+                fixed = self._generate_json([self._repair_prompt(text, schema, error)], stage="llm_repair", schema=schema)
+                return parse(self._parse_json(fixed.text or ""))
+            except ValueError as e:
+                error = e
+                logger.warning(f"Repair Failed [{stage}]: {error}")
+        if not retry: raise error
+        return parse(self._parse_json(self._generate_json(prompt, stage=f"{stage}_retry", schema=schema, system=system).text or ""))
+
+    def _generate_typed(self, prompt, schema: dict, parse: Callable, stage: str = "llm_card", retry: bool = True,
+                        system: Optional[str] = None):
+        """스키마를 지정해 생성하고 parse(dict/list)로 변환한 결과를 반환"""
+        response = self._generate_json(prompt, stage=stage, schema=schema, system=system)
+        return self._parse_typed(response.text, prompt, schema, parse, stage, retry, system)
+
+    def generate_story_card(self, image, config: StoryConfig, use_cache: bool = True) -> StoryCard:
+        try:
+            resized_image = ImagePipeline.load(image).thumbnail
+
+            cache_key = StoryCardCache.make_key(resized_image, config)
+            if use_cache:
+                cached = CARD_CACHE.get(cache_key)
+                if cached:
+                    cached.image_key = f"img_{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+                    return cached
+
+            # 사진별 요청에는 썸네일만 실음 (지시문은 설정별 시스템 지시로 재사용)
+            prompt, system = self._card_request(config, [resized_image])
+            card = self._generate_typed(prompt, CARD_SCHEMA, self._card_from_data, system=system)
+            CARD_CACHE.put(cache_key, card)
+            return card
         except Exception as e:
             logger.error(f"LLM Error: {e}")
-            return StoryCard(character_name="오류 요정", story_narration="잠시 연결이 불안정했어요.", dialogue="다시 시도해볼까?", image_key=f"err_{datetime.now().strftime('%Y%m%d%H%M%S%f')}")
-        return StoryCard()
+            return self._error_card()
+
+    def submit_story_card(self, image, config: StoryConfig, use_cache: bool = True) -> Future:
+        """공유 백그라운드 풀에서 카드 생성을 시작하고 Future를 반환"""
+        return background_pool().submit(self.generate_story_card, image, config, use_cache)
+
+    def map_story_cards(self, images, config: StoryConfig, concurrency: int = DEFAULT_CONCURRENCY,
+                        on_progress: Optional[Callable[[int, int], None]] = None, use_cache: bool = True,
+                        prefetched: Optional[Dict[str, Future]] = None,
+                        on_result: Optional[Callable[[int, StoryCard], None]] = None) -> List[StoryCard]:
+        """여러 사진의 카드를 제한된 작업자 풀로 동시에 생성 (결과는 입력 순서 유지)
+
+        prefetched: {사진 digest: 이미 시작된 카드 생성 Future} - 해당 사진은 새로 호출하지 않고 결과만 기다림
+        on_result: 카드 하나가 나올 때마다 (사진 번호, 카드)로 호출
+        """
+        total = len(images)
+        cards: List[Optional[StoryCard]] = [None] * total
+        if not total: return []
+        prefetched = prefetched or {}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, total)), thread_name_prefix="phodong-card") as pool:
+            futures = {}
+            for i, img in enumerate(images):
+                fut = prefetched.get(getattr(img, "digest", None))
+                futures[fut if fut else submit_traced(pool, self.generate_story_card, img, config, use_cache)] = i
+            # 완료되는 순서대로 진행률을 올림 (콜백은 호출한 스레드에서 실행됨)
+            for done, fut in enumerate(as_completed(futures), start=1):
+                i = futures[fut]
+                try: cards[i] = fut.result()
+                except Exception as e:
+                    logger.error(f"Card Worker Error: {e}")
+                    cards[i] = self._error_card()
+                if on_result: on_result(i, cards[i])
+                if on_progress: on_progress(done, total)
+        logger.info(f"Card Cache: {CARD_CACHE.stats()}")
+        return cards
+
+    def _generate_batch(self, images: List[PreparedImage], config: StoryConfig) -> dict:
+        """사진 여러 장을 한 번의 호출로 보내고 {index: StoryCard}를 반환 (빠지거나 깨진 항목은 제외)"""
+        contents = [f"""
+                [묶음 요청]
+                아래에 사진 {len(images)}장이 [사진 0]부터 순서대로 주어집니다.
+                사진마다 지시된 형식의 카드를 하나씩 만들고, 각 카드에 사진 번호를 "index" (정수) 필드로 넣어
+                JSON 배열 하나로만 답하세요.
+                """]
+        for i, img in enumerate(images):
+            contents += [f"[사진 {i}]", img.thumbnail]
+        prompt, system = self._card_request(config, contents)
 
-    def generate_final_story(self, cards: List[StoryCard], config: StoryConfig) -> str:
+        def parse(data) -> list:
+            if not isinstance(data, list): raise ValueError(f"batch must be an array, got {type(data).__name__}")
+            return data
+
+        try:
+            # 깨진 응답은 고치기만 시도하고, 그래도 안 되면 사진별 호출로 보충 (묶음 전체를 다시 보내지 않음)
+            data = self._generate_typed(prompt, CARDS_SCHEMA, parse, stage="llm_batch", retry=False, system=system)
+        except Exception as e:
+            logger.error(f"LLM Batch Error: {e}")
+            return {}
+
+        results = {}
+        for item in data:
+            if not isinstance(item, dict): continue
+            try:
+                idx = int(item.get("index"))
+                card = self._card_from_data(item)
+            except (TypeError, ValueError): continue
+            if 0 <= idx < len(images) and idx not in results:
+                results[idx] = card
+        return results
+
+    def generate_story_cards(self, images, config: StoryConfig, batch_size: int = DEFAULT_BATCH_SIZE,
+                             concurrency: int = DEFAULT_CONCURRENCY, on_progress: Optional[Callable[[int, int], None]] = None,
+                             use_cache: bool = True, prefetched: Optional[Dict[str, Future]] = None,
+                             on_result: Optional[Callable[[int, StoryCard], None]] = None) -> List[StoryCard]:
+        """여러 사진을 batch_size장씩 묶어 한 번에 생성 (누락된 카드만 사진별 호출로 보충)"""
+        prepared = [ImagePipeline.load(img) for img in images]
+        total = len(prepared)
+        cards: List[Optional[StoryCard]] = [None] * total
+        if not total: return []
+        prefetched = prefetched or {}
+
+        keys = [StoryCardCache.make_key(p.thumbnail, config) for p in prepared]
+        pending, waiting = [], []
+        for i, key in enumerate(keys):
+            if prepared[i].digest in prefetched:
+                waiting.append(i)
+                continue
+            cached = CARD_CACHE.get(key) if use_cache else None
+            if cached:
+                cached.image_key = f"img_{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+                cards[i] = cached
+                if on_result: on_result(i, cached)
+            else: pending.append(i)
+
+        done = total - len(pending) - len(waiting)
+        if on_progress and done: on_progress(done, total)
+        batches = [pending[j:j + max(1, batch_size)] for j in range(0, len(pending), max(1, batch_size))]
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(pending))), thread_name_prefix="phodong-batch") as pool:
+            # 값: 묶음 호출이면 사진 번호 목록, 사진별 보충 호출이면 사진 번호 하나
+            # 한 장짜리 묶음 (4k+1장 앨범의 마지막 등)은 배열 응답을 요구할 이유가 없으므로 사진별 호출로 보냄
+            futures = {(submit_traced(pool, self._generate_batch, [prepared[i] for i in batch], config) if len(batch) > 1 else
+                        submit_traced(pool, self.generate_story_card, prepared[batch[0]], config, use_cache=False)):
+                       (batch if len(batch) > 1 else batch[0]) for batch in batches}
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    batch = futures.pop(fut)
+                    if isinstance(batch, int):
+                        cards[batch] = fut.result()
+                        ready = [batch]
+                    else:
+                        results = fut.result()
+                        ready = [i for pos, i in enumerate(batch) if pos in results]
+                        missing = [i for pos, i in enumerate(batch) if pos not in results]
+                        for pos, i in enumerate(batch):
+                            if pos in results:
+                                cards[i] = results[pos]
+                                CARD_CACHE.put(keys[i], results[pos])
+                        if missing: logger.warning(f"Batch returned {len(ready)}/{len(batch)} cards, retrying {len(missing)} individually")
+                        # 빠진 항목만 사진별 호출로 보충 (같은 풀에 넣어 다른 묶음의 결과 처리를 막지 않음)
+                        for i in missing: futures[submit_traced(pool, self.generate_story_card, prepared[i], config, use_cache=False)] = i
+                    if on_result:
+                        for i in ready: on_result(i, cards[i])
+                    done += len(ready)
+                    if on_progress and ready: on_progress(done, total)
+
+        # 미리 시작된 카드는 결과만 기다림
+        for i in waiting:
+            try: cards[i] = prefetched[prepared[i].digest].result()
+            except Exception as e:
+                logger.error(f"Card Worker Error: {e}")
+                cards[i] = self._error_card()
+            if on_result: on_result(i, cards[i])
+            done += 1
+            if on_progress: on_progress(done, total)
+        logger.info(f"Card Cache: {CARD_CACHE.stats()}")
+        return cards
+
+    def generate_continuation_card(self, base: StoryCard, config: StoryConfig) -> StoryCard:
+        """거의 같은 사진을 위한 '다음 장면' 카드 (사진 없이 텍스트만 보내는 가벼운 호출)"""
+        prompt, system = self._card_request(config, [f"""
+                [이어지는 장면]
+                방금 전 장면과 거의 같은 사진입니다. 같은 캐릭터 '{base.character_name}'({base.character_type})의 바로 다음 장면을 만드세요.
+                - 이전 상황: {base.story_narration}
+                - 이전 대사: {base.dialogue}
+                character_name, character_type, personality, magic_power는 그대로 두고 story_narration과 dialogue만 새로 쓰세요.
+                """])
+        try:
+            # 캐릭터 설정은 이전 카드에서 채우되, 새 장면(story_narration/dialogue)이 비어 있으면 깨진 응답으로 봄
+            traits = {k: getattr(base, k) for k in ("character_name", "character_type", "personality", "magic_power")}
+            return self._generate_typed(prompt, CARD_SCHEMA, lambda data: self._card_from_data({**data, **traits} if isinstance(data, dict) else data),
+                                        stage="llm_continuation", system=system)
+        except Exception as e:
+            logger.error(f"LLM Continuation Error: {e}")
+            return replace(base)
+
+    def generate_cards(self, images, config: StoryConfig, engine: str = DEFAULT_ENGINE,
+                       dedupe_distance: int = DEDUPE_DISTANCE, continuation: bool = DEDUPE_CONTINUATION,
+                       on_progress: Optional[Callable[[int, int], None]] = None,
+                       on_result: Optional[Callable[[int, StoryCard], None]] = None,
+                       prefetched: Optional[Dict[str, Future]] = None, **kwargs) -> List[StoryCard]:
+        """카드 생성 엔진 선택 ("concurrent": 사진별 동시 호출, "batch": 여러 장 묶음 호출)
+
+        거의 같은 사진(연사 등)은 묶어서 대표 사진만 생성하고, 나머지는 대표 카드를 재사용하거나
+        (continuation=True) 사진 없이 '다음 장면' 카드를 요청함. 결과 요약은 self.last_summary에 남음
+        (입력 토큰 중 명시적 컨텍스트 캐시에서 할인된 cached_tokens 포함, system 방식에서는 0)
+        """
+        start, usage = time.perf_counter(), self.usage()
+        prepared = [ImagePipeline.load(img) for img in images]
+        total = len(prepared)
+        prefetched = prefetched or {}
+        # 이미 미리 생성 중인 사진은 묶지 않음 (이미 낸 호출을 버리지 않도록)
+        # 카메라는 촬영 시점에 거의 같은 사진의 미리 생성을 건너뛰므로, 그 사진은 여기서 앞 사진의 묶음에 들어감
+        leaders = ImagePipeline.group_near_duplicates(prepared, dedupe_distance, keep={d for d in prefetched})
+        unique = sorted(set(leaders))
+        followers: Dict[int, List[int]] = {i: [] for i in unique}
+        for i, leader in enumerate(leaders):
+            if leader != i: followers[leader].append(i)
+
+        cards: List[Optional[StoryCard]] = [None] * total
+        done = 0
+
+        def leader_done(j: int, card: StoryCard):
+            nonlocal done
+            i = unique[j]
+            cards[i] = card
+            group = [i] if continuation else [i] + followers[i]
+            for k in group[1:]: cards[k] = replace(card)
+            for k in group:
+                if on_result: on_result(k, cards[k])
+            done += len(group)
+            if on_progress: on_progress(done, total)
+
+        subset = [prepared[i] for i in unique]
+        if engine == "batch": self.generate_story_cards(subset, config, on_result=leader_done, prefetched=prefetched, **kwargs)
+        else: self.map_story_cards(subset, config, on_result=leader_done, prefetched=prefetched, **kwargs)
+
+        pending = [(k, i) for i in unique for k in followers[i]] if continuation else []
+        if pending:
+            concurrency = kwargs.get("concurrency", DEFAULT_CONCURRENCY)
+            with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(pending))), thread_name_prefix="phodong-card") as pool:
+                futures = {submit_traced(pool, self.generate_continuation_card, cards[i], config): k for k, i in pending}
+                for fut in as_completed(futures):
+                    k = futures[fut]
+                    cards[k] = fut.result()
+                    if on_result: on_result(k, cards[k])
+                    done += 1
+                    if on_progress: on_progress(done, total)
+
+        saved = total - len(unique)
+        used = {k: v - usage[k] for k, v in self.usage().items()}
+        self.last_summary = {"images": total, "groups": len(unique), "near_duplicates": saved,
+                             "calls_saved": 0 if continuation else saved, "continuations": len(pending),
+                             "calls": used["calls"], "prompt_tokens": used["prompt_tokens"], "cached_tokens": used["cached_tokens"],
+                             "cached_ratio": round(used["cached_tokens"] / used["prompt_tokens"], 3) if used["prompt_tokens"] else 0.0}
+        METRICS.record("dedupe", 0.0, images=total, calls_saved=self.last_summary["calls_saved"])
+        METRICS.record("prefix_cache", 0.0, prompt_tokens=used["prompt_tokens"], cached_tokens=used["cached_tokens"])
+        logger.info(f"Card Engine [{engine}]: {total} images in {time.perf_counter() - start:.2f}s, summary={self.last_summary}")
+        return cards
+
+    @staticmethod
+    def _final_prompt(cards: List[StoryCard], config: StoryConfig) -> str:
         scenes = "\n".join([f"- {c.character_name}: \"{c.dialogue}\" ({c.story_narration})" for c in cards])
 
-        prompt = f"""
+        return f"""
         당신은 세계적인 동화 작가입니다. 
         아래의 장면 조각들을 모아 '{config.child_name}'와 '{config.partner_name}'가 주인공인 하나의 완벽하고 아름다운 동화를 완성하세요.
 
         [조건]
-        1. **제목**: 첫 줄에 창의적인 제목을 적어주세요.
+        1. **제목**: 창의적인 제목을 title에, 본문은 story에 적어 {{"title": ..., "story": ...}} 순서의 JSON으로 답하세요.
         2. **문체**: 아이에게 읽어주는 듯한 다정하고 부드러운 '해요체'를 사용하세요.
         3. **구성**: 기승전결이 자연스럽게 이어지도록 장면 사이의 연결 문장을 풍부하게 추가하세요.
         4. **분량**: 각 장면의 묘사를 살려 충분히 길고 풍성하게 작성하세요.
@@ -152,17 +802,119 @@ class LLMService:
         {scenes}
         """
 
-        try: return self.model.generate_content(prompt).text
-        except: return "이야기 생성에 실패했어요"
+    def generate_final_story(self, cards: List[StoryCard], config: StoryConfig) -> FinalStory:
+        prompt = [self._final_prompt(cards, config)]
+        try: return self._generate_typed(prompt, FINAL_STORY_SCHEMA, FinalStory.from_dict, stage="final_story")
+        except Exception as e:
+            logger.error(f"LLM Final Story Error: {e}")
+            return FinalStory.failed()
+
+    def parse_final_story(self, text: str, cards: List[StoryCard], config: StoryConfig, complete: bool = True) -> FinalStory:
+        """스트리밍으로 모은 JSON 텍스트를 FinalStory로 한 번만 파싱 (깨졌으면 고치기/다시 생성)
+
+        complete=False (스트림이 중간에 끊김)면 잘린 본문을 고치기로 메우지 않고 바로 전체를 다시 생성함
+        (고치기는 끝까지 도착했지만 형식이 틀린 응답에만 씀)
+        """
+        if not complete: return self.generate_final_story(cards, config)
+        try: return self._parse_typed(text, [self._final_prompt(cards, config)], FINAL_STORY_SCHEMA, FinalStory.from_dict, stage="final_story")
+        except Exception as e:
+            logger.error(f"LLM Final Story Error: {e}")
+            return FinalStory.failed()
+
+    def generate_final_story_stream(self, cards: List[StoryCard], config: StoryConfig) -> Iterator[str]:
+        """최종 동화 JSON({"title", "story"})을 텍스트 조각 단위로 스트리밍
+
+        화면에는 FinalStory.from_partial로 그리고, 다 모이면 parse_final_story로 한 번만 파싱함.
+        스트림이 실패하면 (첫 조각 이후라도) 기록한 뒤 예외를 그대로 올려 호출하는 쪽이 잘린 응답임을 알게 함
+        """
+        yielded, error = False, None
+        prompt = self._final_prompt(cards, config)
+        start, chars = time.perf_counter(), 0
+        try:
+            for piece in self.scheduler.stream(self.session_id, self.backend.generate_stream, prompt,
+                                               response_mime_type="application/json", response_schema=FINAL_STORY_SCHEMA):
+                if not yielded: METRICS.record("final_story_first_chunk", time.perf_counter() - start)
+                yielded = True
+                chars += len(piece)
+                yield piece
+        except Exception as e:
+            logger.error(f"LLM Stream Error: {e}")
+            error = e
+        METRICS.record("final_story", time.perf_counter() - start, prompt_chars=len(prompt), response_chars=chars,
+                       error=error is not None or not yielded)
+        if error: raise error
 
 class AudioService:
+    """문장 단위로 나눠 병렬 합성하고, 조각별로 캐시하는 TTS"""
+    backend: Optional[TTSBackend] = None   # 지정하지 않으면 첫 사용 시 PHODONG_BACKEND 설정으로 생성
+    _cache: "OrderedDict[str, bytes]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def clean(text: str) -> str:
+        return re.sub(r"[\*\#]", "", text)
+
     @staticmethod
-    def create(text: str) -> Optional[bytes]:
+    def split_sentences(text: str, limit: int = TTS_CHUNK_CHARS) -> List[str]:
+        """문장 경계에서 잘라 limit 글자 이하의 조각으로 묶음 (긴 문장은 쉼표/공백에서 다시 자름)"""
+        pieces = []
+        for sentence in re.split(r"(?<=[.!?~…。])\s+|\n+", text):
+            sentence = sentence.strip()
+            while len(sentence) > limit:
+                cut = max(sentence.rfind(",", 0, limit), sentence.rfind(" ", 0, limit))
+                cut = cut + 1 if cut > 0 else limit
+                pieces.append(sentence[:cut].strip())
+                sentence = sentence[cut:].strip()
+            if sentence: pieces.append(sentence)
+
+        chunks, cur = [], ""
+        for piece in pieces:
+            if cur and len(cur) + 1 + len(piece) > limit:
+                chunks.append(cur)
+                cur = piece
+            else: cur = f"{cur} {piece}" if cur else piece
+        if cur: chunks.append(cur)
+        return chunks
+
+    @classmethod
+    def synthesize(cls, chunk: str, lang: str = TTS_LANG) -> bytes:
+        """한 조각을 MP3로 합성 (텍스트+언어 해시로 캐시)"""
+        key = hashlib.sha256(f"{lang}\0{chunk}".encode("utf-8")).hexdigest()
+        with cls._lock:
+            if key in cls._cache:
+                cls._cache.move_to_end(key)
+                return cls._cache[key]
+
+        if cls.backend is None: cls.backend = create_tts_backend()
+        with METRICS.span("tts_chunk", prompt_chars=len(chunk)) as span:
+            audio = cls.backend.synthesize(chunk, lang)
+            span["bytes_out"] = len(audio)
+
+        with cls._lock:
+            cls._cache[key] = audio
+            while len(cls._cache) > TTS_CACHE_MAX_ITEMS: cls._cache.popitem(last=False)
+        return audio
+
+    @classmethod
+    def stream(cls, text: str, lang: str = TTS_LANG, concurrency: int = TTS_CONCURRENCY) -> Iterator[bytes]:
+        """조각들을 동시에 합성하되 순서대로 내보냄 (첫 조각은 나머지를 기다리지 않고 바로 나옴)"""
+        chunks = cls.split_sentences(cls.clean(text))
+        if not chunks: return
+        pool = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks))), thread_name_prefix="phodong-tts")
+        try:
+            futures = [submit_traced(pool, cls.synthesize, c, lang) for c in chunks]
+            for fut in futures: yield fut.result()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @classmethod
+    def create(cls, text: str, lang: str = TTS_LANG) -> Optional[bytes]:
+        # MP3 프레임은 이어 붙여도 재생되므로 조각을 순서대로 연결
         try:
-            clean = re.sub(r"[\*\#]", "", text)
-            tts = gTTS(text=clean[:5000], lang='ko', slow=False)
-            fp = io.BytesIO()
-            tts.write_to_fp(fp)
-            fp.seek(0)
-            return fp.read()
-        except: return None
\ No newline at end of file
+            with METRICS.span("tts", prompt_chars=len(text)) as span:
+                audio = b"".join(cls.stream(text, lang))
+                span["bytes_out"] = len(audio)
+            return audio or None
+        except Exception as e:
+            logger.error(f"TTS Error: {e}")
+            return None